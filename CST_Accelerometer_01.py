@@ -1,3 +1,5 @@
+import struct
+import threading
 import time
 import numpy as np
 import serial
@@ -83,3 +85,160 @@ class AccelerometerBase(object):
         except:
             print("Accel object (probably) already closed")
 
+
+
+class AccelerometerStreaming(AccelerometerBase):
+    """
+    Accelerometer read in continuous streaming mode.
+
+    The sensor streams tared Euler angles with its device timestamp.
+    A reader thread decodes each line into 'latest', a
+    (device_timestamp, host_time, (x, y), euler) tuple that is swapped
+    in whole, so getPos() returns immediately without a serial
+    round-trip on the render thread.
+
+    Note: at the default 19200 baud an ASCII sample line limits the
+    stream to roughly 40-50 Hz; use a higher baud for faster streams.
+    Request/response calls (send_and_return) must not be used while
+    streaming, since the reader thread owns the input side of the port.
+    Only one instance streams at a time; starting a new stream stops the
+    previous one so two readers never share the port.
+    """
+
+    active_stream = None
+
+    def __init__(self):
+        super().__init__()
+        self.latest = (0.0, 0.0, (0.0, 0.0), (0.0, 0.0, 0.0))
+        self.num_samples = 0
+        self.num_bad_lines = 0
+        self.__streaming = threading.Event()
+        self.__first_sample = threading.Event()
+        self.__reader = None
+
+    def start_streaming(self, stream_hz=40, wait_secs=1.0):
+        previous = AccelerometerStreaming.active_stream
+        if previous is not None and previous is not self:
+            previous.stop_streaming()
+        AccelerometerStreaming.active_stream = self
+
+        interval_us = 1e6 / stream_hz
+        self.ser.write(self.consts.include_timestamp)
+        self.ser.write(self.consts.set_stream_slots_tared_euler)
+        self.ser.write(self.consts.stream_timing(interval_us))
+        self.ser.flush()
+        self.ser.reset_input_buffer()
+
+        self.__streaming.set()
+        self.__reader = threading.Thread(
+            target=self.__read_stream, name="AccelerometerStream", daemon=True
+        )
+        self.__reader.start()
+        self.ser.write(self.consts.start_streaming)
+        self.ser.flush()
+        if self.__first_sample.wait(wait_secs) is False:
+            print(f"Accelerometer: no streamed sample after {wait_secs} s")
+
+    def stop_streaming(self):
+        if self.__streaming.is_set():
+            self.__streaming.clear()
+            self.ser.write(self.consts.stop_streaming)
+            self.ser.flush()
+            self.__reader.join()
+        if AccelerometerStreaming.active_stream is self:
+            AccelerometerStreaming.active_stream = None
+
+    def __read_stream(self):
+        while self.__streaming.is_set():
+            line = self.ser.readline()
+            if len(line) == 0:
+                continue  # serial timeout
+            try:
+                ts, ox, oy, oz = [
+                    float(v) for v in line.decode().split("\r")[0].split(",")
+                ]
+            except (UnicodeDecodeError, ValueError):
+                self.num_bad_lines += 1
+                continue
+            self.latest = (ts, time.perf_counter(), (ox, oz), (ox, oy, oz))
+            self.num_samples += 1
+            self.__first_sample.set()
+
+    def get_latest_sample(self):
+        """Return (device_timestamp, host_time, euler) of the newest sample."""
+        ts, host_time, _, euler = self.latest
+        return ts, host_time, euler
+
+    def getPos(self):
+        return self.latest[2]
+
+    def poll_and_update(self):
+        """Tared orientation with device timestamp, from the newest sample."""
+        ts, _, _, euler = self.latest
+        self.orient = np.array((ts,) + euler)
+
+    def shutdown(self):
+        try:
+            self.stop_streaming()
+        except:
+            print("Accel stream (probably) already stopped")
+        super().shutdown()
+
+
+class AccelerometerBinary(AccelerometerBase):
+    """
+    Accelerometer read over the sensor's binary protocol.
+
+    Commands are the SerialConstants2 entries translated by as_binary().
+    Each response has a fixed size, so it is read straight into a
+    bytearray allocated once per command and decoded with a precompiled
+    struct.Struct; no line splitting or string-to-float conversion.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__commands = {}
+
+    def connect_to_wired(self, *args, **kwargs):
+        super().connect_to_wired(*args, **kwargs)
+        # ';' commands return the device timestamp in their header
+        self.ser.write(self.consts.include_timestamp)
+        self.ser.flush()
+
+    def __command(self, request):
+        """Binary packet, decoder and reusable receive buffer for 'request'."""
+        entry = self.__commands.get(request)
+        if entry is None:
+            packet, fmt = self.consts.as_binary(request)
+            decoder = struct.Struct(fmt)
+            entry = (packet, decoder, bytearray(decoder.size))
+            self.__commands[request] = entry
+        return entry
+
+    def send_and_return_binary(self, request):
+        packet, decoder, buf = self.__command(request)
+        self.ser.write(packet)
+        self.ser.flush()  # make sure write is done
+        num_read = self.ser.readinto(buf)
+        if num_read != len(buf):
+            raise IOError(
+                f"Accelerometer: expected {len(buf)} bytes, received {num_read}"
+            )
+        return decoder.unpack_from(buf)
+
+    def getPos(self):
+        ox, _, oz = self.send_and_return_binary(self.consts.get_tared_as_euler)
+        return (ox, oz)
+
+    def poll_and_update(self):
+        """basic update for tared orientation, with device timestamp"""
+        self.orient = np.array(
+            self.send_and_return_binary(self.consts.get_tared_as_euler_w_ts),
+            dtype=float,
+        )
+
+    def reset_state(self):
+        self.reset_timestamp_value = self.send_and_return_binary(
+            self.consts.get_button_state
+        )[0]
+        self.re_center()
@@ -0,0 +1,233 @@
+"""
+Cohort summary of CST sessions in the BIDS-style output tree.
+
+Finds every sub-*/ses-*/raw/*_task-CPT*_events file (CSV, Parquet,
+Feather or HDF5) under the output root, computes per-run metrics with
+NumPy in a pool of worker processes, and writes one tidy table with a
+row per run, plus a table with a row per crash. Per-file results are cached by modification time
+and size, so re-runs only process new or changed sessions.
+
+    python CST_Analytics.py /home/nkirs/Desktop/MOBI/Output --jobs 8
+    python CST_Analytics.py Output --out cohort.csv --crashes_out crashes.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from CST_SessionLog import OUTPUT_EXTENSIONS, read_session_log
+
+SESSION_PATTERN = "sub-*/ses-*/raw/*_task-CPT*_events.*"
+ENTITY_RE = re.compile(r"(sub|ses|task|run)-([^_]+)")
+CACHE_VERSION = 1
+
+SUMMARY_COLUMNS = [
+    "sub",
+    "ses",
+    "task",
+    "run",
+    "num_frames",
+    "duration_secs",
+    "num_crashes",
+    "crashes_per_min",
+    "lambda_c_mean",
+    "lambda_c_median",
+    "lambda_c_last",
+    "rms_stim_pos",
+    "secs_within_outer",
+    "prop_within_outer",
+    "frame_interval_ms",
+    "flip_jitter_ms",
+    "flip_error_p99_ms",
+    "path",
+]
+CRASH_COLUMNS = ["sub", "ses", "task", "run", "crash", "flip_time", "lambda_c"]
+
+
+def bids_entities(path):
+    """sub/ses/task/run from a BIDS-style file name."""
+    found = dict(ENTITY_RE.findall(Path(path).name))
+    return {k: found.get(k, "") for k in ("sub", "ses", "task", "run")}
+
+
+def session_metrics(path, outer_radius=0.05):
+    """
+    Metrics for one _events file. The stimulus target is the center, so
+    the stim_pos error is stim_pos itself. Frame intervals that end on
+    a crash frame span the crash pause and are left out of the timing
+    metrics.
+    """
+    log = read_session_log(path)
+    flip_time = log["flip_time"]
+    # drop the extra record written at stop
+    if len(flip_time) > 1 and flip_time[-1] == flip_time[-2]:
+        log = {k: v[:-1] for k, v in log.items()}
+        flip_time = log["flip_time"]
+    stim_pos = log["stim_pos"]
+    did_crash = log["did_crash"].astype(bool)
+    num_frames = len(flip_time)
+
+    metrics = {"num_frames": num_frames, "lambda_c": [], "crash_times": []}
+    if num_frames < 2:
+        return metrics
+
+    intervals = np.diff(flip_time)
+    in_play = ~did_crash[1:]
+    duration = float(intervals[in_play].sum())
+    within = np.abs(stim_pos[:-1]) < outer_radius
+    lambda_c = log["lambda_val"][did_crash]
+
+    metrics.update(
+        {
+            "duration_secs": duration,
+            "num_crashes": int(did_crash.sum()),
+            "crashes_per_min": (
+                float(did_crash.sum() / duration * 60) if duration else None
+            ),
+            "lambda_c_mean": float(lambda_c.mean()) if len(lambda_c) else None,
+            "lambda_c_median": float(np.median(lambda_c)) if len(lambda_c) else None,
+            "lambda_c_last": float(lambda_c[-1]) if len(lambda_c) else None,
+            "rms_stim_pos": float(np.sqrt(np.mean(stim_pos**2))),
+            "secs_within_outer": float(intervals[within & in_play].sum()),
+            "prop_within_outer": float(within[in_play].mean()),
+            "frame_interval_ms": float(np.median(intervals[in_play]) * 1000),
+            "flip_jitter_ms": float(intervals[in_play].std() * 1000),
+            "lambda_c": lambda_c.tolist(),
+            "crash_times": flip_time[did_crash].tolist(),
+        }
+    )
+    if "flip_error" in log:
+        metrics["flip_error_p99_ms"] = float(
+            np.percentile(np.abs(log["flip_error"][1:][in_play]), 99) * 1000
+        )
+    return metrics
+
+
+def file_key(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != CACHE_VERSION:
+        return {}
+    return cache["files"]
+
+
+def save_cache(cache_path, files):
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": CACHE_VERSION, "files": files}, f)
+    os.replace(tmp_path, cache_path)
+
+
+def summarize(root, outer_radius=0.05, jobs=None, cache_path=None):
+    """
+    Metrics for every session under 'root', as {path: metrics}. Files
+    whose mtime and size match the cache (and were computed with the
+    same outer_radius) are not read again.
+    """
+    paths = sorted(
+        str(p)
+        for p in Path(root).glob(SESSION_PATTERN)
+        if p.suffix in OUTPUT_EXTENSIONS.values()
+    )
+    cached = load_cache(cache_path) if cache_path is not None else {}
+
+    results = {}
+    todo = []
+    for path in paths:
+        entry = cached.get(path)
+        if (
+            entry is not None
+            and entry["key"] == file_key(path)
+            and entry["outer_radius"] == outer_radius
+        ):
+            results[path] = entry["metrics"]
+        else:
+            todo.append(path)
+
+    if len(todo) > 0:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            computed = pool.map(
+                session_metrics,
+                todo,
+                [outer_radius] * len(todo),
+                chunksize=max(1, len(todo) // 64),
+            )
+            for path, metrics in zip(todo, computed):
+                results[path] = metrics
+                cached[path] = {
+                    "key": file_key(path),
+                    "outer_radius": outer_radius,
+                    "metrics": metrics,
+                }
+
+    if cache_path is not None:
+        # forget sessions that are gone
+        save_cache(cache_path, {p: cached[p] for p in paths})
+    num_cached = len(paths) - len(todo)
+    print(f"{len(paths)} sessions: {len(todo)} processed, {num_cached} cached")
+    return results
+
+
+def write_tables(results, out_path, crashes_path=None):
+    with open(out_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, SUMMARY_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for path, metrics in results.items():
+            writer.writerow({**bids_entities(path), **metrics, "path": path})
+
+    if crashes_path is None:
+        return
+    with open(crashes_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CRASH_COLUMNS)
+        for path, metrics in results.items():
+            keys = list(bids_entities(path).values())
+            crashes = zip(metrics["crash_times"], metrics["lambda_c"])
+            for k, (flip_time, lambda_c) in enumerate(crashes):
+                writer.writerow(keys + [k, flip_time, lambda_c])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("root", help="Output root holding the sub-* folders")
+    parser.add_argument("--out", default="cst_cohort_summary.csv")
+    parser.add_argument("--crashes_out", default=None, help="Per-crash table")
+    parser.add_argument("--jobs", type=int, default=None, help="Default: all CPUs")
+    parser.add_argument(
+        "--outer_radius",
+        type=float,
+        default=0.05,
+        help="Radius counted as on target; outer_stim's radius. Default=0.05",
+    )
+    parser.add_argument(
+        "--cache",
+        default=None,
+        help="Cache file. Default: .cst_analytics_cache.json in the root",
+    )
+    parser.add_argument("--no_cache", action="store_true")
+    args = parser.parse_args()
+
+    cache_path = None
+    if not args.no_cache:
+        cache_path = args.cache or str(Path(args.root) / ".cst_analytics_cache.json")
+    results = summarize(args.root, args.outer_radius, args.jobs, cache_path)
+    write_tables(results, args.out, args.crashes_out)
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import numpy as np
+from CST_Calculations import CST_Model
+
+
+class CST_BatchModel(object):
+    """
+    Headless, vectorized version of the CST_Model / StateMachine loop.
+
+    Runs many independent trajectories at once as NumPy arrays. Each
+    trajectory has its own user_pos input series, lambda intercept and
+    slope, and SCALE_VALS crash schedule. The update order follows
+    StateMachine.run exactly:
+        1. crash check on the distance computed by the previous step
+        2. on crash: store lambda_c, lower the intercept by
+           scale_val * lambda_val, slow the slope, reset the stimulus
+        3. flip (here: nominal onset + accumulated crash pauses)
+        4. CST_Model.update_model
+
+    Inputs:
+        onsets         : 1D array of nominal frame onsets (seconds), as
+                         returned by compute_timeseries
+        max_bounds     : distance from center that counts as a crash
+        num_test_trials: number of crashes after which a trajectory stops
+                         (the CALIBRATE stopping rule); None = never stop
+        max_seconds    : trajectories stop once flip time reaches this
+        crash_pause    : seconds added to the schedule per crash, standing
+                         in for the error screen + reset screen waits
+
+    Methods:
+        run(user_pos, lambda_intercept, lambda_slope, scale_vals, ...)
+            returns a dictionary of per-trajectory results.
+    """
+
+    def __init__(
+        self,
+        onsets,
+        max_bounds=0.8,
+        num_test_trials=10,
+        max_seconds=600,
+        crash_pause=2.5,
+    ):
+        self.onsets = np.asarray(onsets, dtype=float)
+        self.max_bounds = max_bounds
+        self.num_test_trials = num_test_trials
+        self.max_seconds = max_seconds
+        self.crash_pause = crash_pause
+
+    @staticmethod
+    def per_trajectory(value, num_traj):
+        """Broadcast a scalar or 1D value to one entry per trajectory."""
+        return np.broadcast_to(np.asarray(value, dtype=float), (num_traj,)).copy()
+
+    def run(
+        self,
+        user_pos,
+        lambda_intercept,
+        lambda_slope,
+        scale_vals,
+        lambda_val=None,
+        max_lambda=10,
+        seed=None,
+        return_trajectories=False,
+    ):
+        """
+        Simulate all trajectories.
+
+        user_pos    : (num_traj, num_frames) array of input positions.
+                      num_frames may be shorter than onsets.
+        lambda_*    : scalar or (num_traj,) arrays
+        scale_vals  : (num_crashes,) or (num_traj, num_crashes) array
+        lambda_val  : starting lambda; defaults to lambda_intercept
+        max_lambda  : scalar or (num_traj,) cap on lambda
+        seed        : seed for the random drift direction after resets
+
+        Returns a dictionary with:
+            lambda_c    : (num_traj, max_crashes) lambda at each crash (NaN pad)
+            crash_times : (num_traj, max_crashes) flip time at each crash (NaN pad)
+            crash_count : (num_traj,) number of crashes
+            end_time    : (num_traj,) last flip time of each trajectory
+            num_frames  : (num_traj,) frames run by each trajectory
+            stim_pos    : (num_traj, num_frames) positions, if requested
+        """
+        user_pos = np.atleast_2d(np.asarray(user_pos, dtype=float))
+        num_traj, num_frames = user_pos.shape
+        num_frames = min(num_frames, len(self.onsets))
+
+        scale_vals = np.asarray(scale_vals, dtype=float)
+        if scale_vals.ndim == 1:
+            scale_vals = np.broadcast_to(scale_vals, (num_traj, len(scale_vals)))
+        max_crashes = scale_vals.shape[1]
+        if self.num_test_trials is not None:
+            max_crashes = min(max_crashes, self.num_test_trials)
+
+        intercept = self.per_trajectory(lambda_intercept, num_traj)
+        slope = self.per_trajectory(lambda_slope, num_traj)
+        cap = self.per_trajectory(max_lambda, num_traj)
+        if lambda_val is None:
+            lam = intercept.copy()
+        else:
+            lam = self.per_trajectory(lambda_val, num_traj)
+
+        rng = np.random.RandomState(seed)
+        # initialize_stim: slow drift randomly to left or right
+        stim_pos = np.where(rng.randint(0, 2, num_traj), -0.005, 0.005)
+        dist = np.zeros(num_traj)
+        flip_time = np.zeros(num_traj)
+        pause_offset = np.zeros(num_traj)
+        crash_count = np.zeros(num_traj, dtype=int)
+        frames_run = np.zeros(num_traj, dtype=int)
+        active = np.ones(num_traj, dtype=bool)
+
+        lambda_c = np.full((num_traj, max_crashes), np.nan)
+        crash_times = np.full((num_traj, max_crashes), np.nan)
+        rows = np.arange(num_traj)
+        if return_trajectories is True:
+            stim_log = np.full((num_traj, num_frames), np.nan)
+
+        for k in range(num_frames):
+            if not active.any():
+                break
+            u = user_pos[:, k].copy()
+
+            crashed = active & (dist > self.max_bounds)
+            if crashed.any():
+                idx = rows[crashed]
+                slot = crash_count[idx]
+                lambda_c[idx, slot] = lam[idx]
+                crash_times[idx, slot] = flip_time[idx]
+                intercept[idx] -= scale_vals[idx, slot] * lam[idx]
+                slope[idx] *= 0.95
+                crash_count[idx] += 1
+                # reset_stim: new drift direction, input back to zero
+                stim_pos[idx] = np.where(rng.randint(0, 2, len(idx)), -0.005, 0.005)
+                u[idx] = 0.0
+                pause_offset[idx] += self.crash_pause
+
+            flip_time = np.where(active, self.onsets[k] + pause_offset, flip_time)
+            if return_trajectories is True:
+                stim_log[active, k] = stim_pos[active]
+
+            # CST_Model.update_model, for every active trajectory at once
+            dist = np.where(active, CST_Model.compute_distance(stim_pos, 0), dist)
+            change_rate = CST_Model.compute_dx_dt(stim_pos, u, lam)
+            stim_pos = np.where(active, stim_pos + change_rate, stim_pos)
+            lam = np.where(
+                active, np.minimum(intercept + slope * flip_time / 1000, cap), lam
+            )
+            frames_run += active
+
+            done = crash_count >= max_crashes
+            if self.max_seconds is not None:
+                done |= flip_time >= self.max_seconds
+            active &= ~done
+
+        results = {
+            "lambda_c": lambda_c,
+            "crash_times": crash_times,
+            "crash_count": crash_count,
+            "end_time": flip_time,
+            "num_frames": frames_run,
+        }
+        if return_trajectories is True:
+            results["stim_pos"] = stim_log
+        return results
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 
@@ -11,6 +13,47 @@ def compute_timeseries(duration_mins, refresh_dur):
     return ts
 
 
+class OnsetSchedule(object):
+    """
+    Frame onsets for one run, shifted by the time spent in pauses.
+
+    The nominal onsets are kept read-only. Pauses (the crash screens)
+    add to a running offset instead of rewriting the array, and
+    iterating yields each onset plus the offset at the time it is
+    reached, so a pause shifts every later onset in O(1).
+
+    Attributes:
+        onsets : nominal onsets, read-only
+        offset : total pause time so far
+        pauses : list of (start, end) pause intervals on the run clock
+    """
+
+    def __init__(self, onsets):
+        self.onsets = np.asarray(onsets, dtype=float).view()
+        self.onsets.flags.writeable = False
+        self.offset = 0.0
+        self.pauses = []
+
+    def __len__(self):
+        return len(self.onsets)
+
+    def __iter__(self):
+        for k in range(len(self.onsets)):
+            yield self.onsets[k] + self.offset
+
+    def add_pause(self, start, end):
+        """Shift all onsets not yet reached by 'end' - 'start' seconds."""
+        self.pauses.append((start, end))
+        self.offset += end - start
+
+    def report(self):
+        return {
+            "num_pauses": len(self.pauses),
+            "total_pause_secs": self.offset,
+            "pauses": [list(p) for p in self.pauses],
+        }
+
+
 class CST_Model(object):
     def __init__(self):
         self.state_params = None
@@ -59,14 +102,111 @@ class CST_Model(object):
         self.task_params = task_params
         self.state_params = state_params
 
-    def update_model(self):
-
+    def update_model(self, dt_scale=1.0):
+        """
+        Advance the stimulus one step. 'dt_scale' is the step length
+        relative to one reference frame (see FixedStepPhysics).
+        """
         user_pos = self.state_params.user_pos
         stim_pos = self.state_params.stim_pos
         lambda_val = self.state_params.lambda_val
         self.state_params.stim_to_center_dist = self.compute_distance(stim_pos, 0)
-        change_rate = self.compute_dx_dt(stim_pos, user_pos, lambda_val)
+        change_rate = self.compute_dx_dt(stim_pos, user_pos, lambda_val) * dt_scale
         self.state_params.change_rate_x = change_rate
         new_x = self.state_params.stim_pos + change_rate
         self.update_lambda_by_params()
         self.state_params.stim_pos = new_x
+
+
+class FixedStepPhysics(object):
+    """
+    Steps a CST_Model at a fixed rate, independent of the display rate.
+
+    Each step samples the input and advances the model by one step of
+    1 / physics_hz seconds. The change per step is scaled by
+    reference_hz / physics_hz, so the dynamics (and so lambda) mean the
+    same thing as when the model ran once per frame at reference_hz.
+
+    run_until() is called by the view while it waits for the next flip:
+    it steps the model on schedule up to the deadline, sleeping between
+    steps. render_pos() then interpolates the stimulus between the last
+    two steps for the flip time.
+
+    Stepping stops once the stimulus is out of bounds (the frame loop
+    handles the crash), and restarts from the current time after any gap
+    longer than 'max_catchup' seconds. The view calls reset() after a
+    crash pause, and the run calls it with the first onset, so nothing
+    moves before the first frame.
+
+    Every step reads the input, so it must be a non-blocking device
+    (mouse, ACCEL_STREAM); get_session_params refuses the serial
+    round-trip accelerometer modes with physics.
+    """
+
+    def __init__(
+        self,
+        cst_model,
+        read_input,
+        physics_hz=1000,
+        reference_hz=30,
+        max_bounds=0.8,
+        max_catchup=0.25,
+    ):
+        self.cst_model = cst_model
+        self.state_params = cst_model.state_params
+        self.read_input = read_input
+        self.dt = 1.0 / physics_hz
+        self.dt_scale = reference_hz / physics_hz
+        self.max_bounds = max_bounds
+        self.max_catchup = max_catchup
+        # time reserved after run_until for drawing the frame
+        self.render_lead = 0.003
+
+        self.sim_time = None
+        self.prev_stim_pos = 0.0
+        self.num_steps = 0
+
+    def reset(self, at_time):
+        """Restart the steps at 'at_time' from the current stimulus."""
+        self.sim_time = at_time
+        self.prev_stim_pos = self.state_params.stim_pos
+        # the bounds checks read the distance, which only a step updates
+        self.state_params.stim_to_center_dist = self.cst_model.compute_distance(
+            self.state_params.stim_pos, 0
+        )
+
+    def step(self):
+        self.state_params.user_pos, _ = self.read_input()
+        self.prev_stim_pos = self.state_params.stim_pos
+        self.cst_model.update_model(self.dt_scale)
+        self.sim_time += self.dt
+        self.num_steps += 1
+
+    def advance_to(self, now):
+        """Run every step due at or before 'now'."""
+        if self.sim_time is None or now - self.sim_time > self.max_catchup:
+            self.reset(now)
+            return
+        while self.sim_time + self.dt <= now:
+            if self.state_params.stim_to_center_dist > self.max_bounds:
+                self.reset(now)
+                return
+            self.step()
+
+    def run_until(self, clock, deadline):
+        """Step on schedule until 'deadline' on 'clock'."""
+        now = clock.getTime()
+        while now < deadline:
+            self.advance_to(now)
+            next_step = min(self.sim_time + self.dt, deadline)
+            if next_step - now > 0.0005:
+                time.sleep(next_step - now - 0.0002)
+            now = clock.getTime()
+        self.advance_to(now)
+
+    def render_pos(self, at_time):
+        """Stimulus position for 'at_time', one step behind the model."""
+        alpha = (at_time - self.sim_time) / self.dt
+        alpha = min(max(alpha, 0.0), 1.0)
+        stim_pos = self.state_params.stim_pos
+        return self.prev_stim_pos + (stim_pos - self.prev_stim_pos) * alpha
@@ -0,0 +1,222 @@
+"""
+SQLite store for calibration lambda_c history.
+
+One row per calibration crash, with the subject, visit, run, the time
+the run ended, the crash index, lambda_val at the crash and the flip
+time. Rows are indexed on (subject, visit, run), so one subject's
+history is a single index lookup however many sessions are stored.
+
+    python CST_CalibrationDB.py import calibration_lambdas.csv
+    python CST_CalibrationDB.py query --sub 001 --ses 1
+"""
+
+import argparse
+import re
+import sqlite3
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibration_lambdas (
+    subject TEXT NOT NULL,
+    visit TEXT NOT NULL,
+    run TEXT NOT NULL,
+    task TEXT,
+    datetime_ended TEXT NOT NULL,
+    crash_index INTEGER NOT NULL,
+    lambda_val REAL NOT NULL,
+    flip_time REAL,
+    UNIQUE (subject, visit, run, datetime_ended, crash_index)
+);
+CREATE INDEX IF NOT EXISTS calibration_lambdas_subject_visit_run
+    ON calibration_lambdas (subject, visit, run);
+"""
+COLUMNS = (
+    "subject",
+    "visit",
+    "run",
+    "task",
+    "datetime_ended",
+    "crash_index",
+    "lambda_val",
+    "flip_time",
+)
+DATE_RE = re.compile(r"^\d{2}/\d{2}/\d{4}$")
+TIME_RE = re.compile(r"^\d{2}:\d{2}:\d{2}$")
+
+
+class CalibrationDB(object):
+    """
+    Calibration lambda_c history in a local SQLite file.
+
+    Each run is written in one transaction, so a crash mid-write leaves
+    no partial run. Adding a run that is already stored (same subject,
+    visit, run and end time) is a no-op, so re-imports are safe. The
+    calibration_lambdas.csv lines carry no visit, so a run added
+    without one takes the visit of the same run already stored, if any:
+    importing a CSV the task also wrote to the database adds nothing.
+    Otherwise an unknown visit or run is stored as "".
+
+    Methods:
+        add_run(...)        stores the crashes of one calibration run
+        history(sub, ...)   rows for a subject, optionally one visit/run
+        lambda_c(sub, ...)  just the lambda_val column of history()
+        subjects()          all stored subjects
+        import_csv(path)    one-shot import of a calibration_lambdas.csv
+    """
+
+    def __init__(self, db_path="calibration_lambdas.sqlite"):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def add_run(
+        self,
+        subject,
+        visit,
+        run,
+        lambda_vals,
+        flip_times=None,
+        task="CPTCalibrate",
+        datetime_ended=None,
+    ):
+        """Store one row per crash; returns the number of rows added."""
+        if datetime_ended is None:
+            datetime_ended = datetime.now().isoformat(timespec="seconds")
+        if flip_times is None:
+            flip_times = [None] * len(lambda_vals)
+        if visit is None:
+            visit = self.stored_visit(subject, run, datetime_ended)
+        rows = [
+            (
+                str(subject),
+                "" if visit is None else str(visit),
+                "" if run is None else str(run),
+                task,
+                datetime_ended,
+                k,
+                float(lambda_val),
+                None if flip_time is None else float(flip_time),
+            )
+            for k, (lambda_val, flip_time) in enumerate(zip(lambda_vals, flip_times))
+        ]
+        with self.conn:
+            cur = self.conn.executemany(
+                f"INSERT OR IGNORE INTO calibration_lambdas ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+        return cur.rowcount
+
+    def stored_visit(self, subject, run, datetime_ended):
+        """Visit of a run already stored with this end time, or None."""
+        row = self.conn.execute(
+            "SELECT visit FROM calibration_lambdas "
+            "WHERE subject = ? AND run = ? AND datetime_ended = ? LIMIT 1",
+            (str(subject), "" if run is None else str(run), datetime_ended),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def history(self, subject, visit=None, run=None):
+        """Rows for 'subject' (and 'visit'/'run', if given), oldest first."""
+        query = "SELECT * FROM calibration_lambdas WHERE subject = ?"
+        args = [str(subject)]
+        if visit is not None:
+            query += " AND visit = ?"
+            args.append(str(visit))
+        if run is not None:
+            query += " AND run = ?"
+            args.append(str(run))
+        query += " ORDER BY datetime_ended, crash_index"
+        return [dict(row) for row in self.conn.execute(query, args)]
+
+    def lambda_c(self, subject, visit=None, run=None):
+        return [row["lambda_val"] for row in self.history(subject, visit, run)]
+
+    def subjects(self):
+        rows = self.conn.execute(
+            "SELECT DISTINCT subject FROM calibration_lambdas ORDER BY subject"
+        )
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def parse_csv_line(line):
+        """
+        Parse one line written by StateMachine.write_out_lambdas:
+        subid, BIDS entities from the output stem (task-, run-; no
+        visit), date, time, lambdas.
+        Returns add_run() keyword arguments, or None for blank lines.
+        """
+        fields = [f.strip() for f in line.strip().split(",")]
+        if len(fields) < 2:
+            return None
+        run = {"subject": fields[0], "visit": None, "run": None, "task": None}
+        date = clock = None
+        lambda_vals = []
+        for field in fields[1:]:
+            if DATE_RE.match(field):
+                date = field
+            elif TIME_RE.match(field):
+                clock = field
+            elif field.startswith("ses-"):
+                run["visit"] = field[len("ses-") :]
+            elif field.startswith("run-"):
+                run["run"] = field[len("run-") :]
+            elif field.startswith("task-"):
+                run["task"] = field[len("task-") :]
+            elif date is not None:
+                lambda_vals.append(float(field))
+        if date is not None:
+            ended = datetime.strptime(
+                f"{date} {clock or '00:00:00'}", "%m/%d/%Y %H:%M:%S"
+            )
+            run["datetime_ended"] = ended.isoformat(timespec="seconds")
+        run["lambda_vals"] = lambda_vals
+        return run
+
+    def import_csv(self, csv_path):
+        """Import a calibration_lambdas.csv; returns rows added."""
+        added = 0
+        with open(csv_path, "r") as f:
+            for line in f:
+                run = self.parse_csv_line(line)
+                if run is not None and len(run["lambda_vals"]) > 0:
+                    added += self.add_run(**run)
+        return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="calibration_lambdas.sqlite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Import calibration CSV files")
+    importer.add_argument("csv_files", nargs="+")
+    query = commands.add_parser("query", help="Print a subject's history")
+    query.add_argument("--sub", required=True)
+    query.add_argument("--ses", default=None)
+    query.add_argument("--run", default=None)
+    args = parser.parse_args()
+
+    with CalibrationDB(args.db) as db:
+        if args.command == "import":
+            for csv_path in args.csv_files:
+                print(f"{csv_path}: {db.import_csv(csv_path)} rows added")
+        else:
+            print(",".join(COLUMNS))
+            for row in db.history(args.sub, args.ses, args.run):
+                print(",".join("" if row[c] is None else str(row[c]) for c in COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 import numpy as np
 
+import queue
+import threading
+import time
 import warnings
 
-from psychopy import event, parallel
-from psychopy.hardware import joystick
-from pygaze.eyetracker import EyeTracker
+from CST_InputFilters import FilteredInput
 
-from CST_Accelerometer_01 import AccelerometerBase
+# Device drivers (psychopy keyboard/mouse, accelerometer/serial,
+# joystick, parallel port, eyetracker) are imported where the selected
+# device is connected, so MoBI_Devices and the headless stand-ins load
+# without them.
 
 
 class CST_User_Input(object):
@@ -43,6 +47,9 @@ class CST_User_Input(object):
             window = psychopy window instance (e.g. from cst_view)
             reverse_coords = make L=R and U=D (Default =False)
             swap_axes = swap X and Y inputs (Default = False)
+        set_input_filter(kind, predict_secs, **params)
+            kind = "kalman" or "one_euro" (see CST_InputFilters)
+            predict_secs = prediction lead, None = measured latency
         get_xy_position()
         get_press_response()
 
@@ -64,6 +71,7 @@ class CST_User_Input(object):
         self.get_press_response = None
 
         self.reset_xy_position = None
+        self.input_filter = None
 
         self.shutdown = None
 
@@ -71,6 +79,8 @@ class CST_User_Input(object):
         # python 3.10 will have switch/case statements; yay...
         self.press_input_mode = press_input.upper()
         if self.press_input_mode == "KB":
+            from psychopy import event
+
             self.__press_input_object = event.getKeys
             # self.__press_object = event.getKeys #keyboard.Keyboard()
             self.get_press_response = self.__get_kb_response  # passing func
@@ -84,7 +94,7 @@ class CST_User_Input(object):
         #     raise ValueError(f"Device {press_input} not supported.")
 
     def connect_xy_object(
-        self, xy_input, window, reverse_coords=False, swap_axes=False
+        self, xy_input, window, reverse_coords=False, swap_axes=False, stream_hz=40
     ):
         """
         General function to configure XY inputs
@@ -92,11 +102,16 @@ class CST_User_Input(object):
         implementation details away from the rest of the code. Your
         ViewModel shouldn't have to care if you are using a joystick,
         trackball, mouse, accelerometer, etc.
+        "ACCEL_STREAM" reads the accelerometer in continuous streaming
+        mode at 'stream_hz' on a background thread; "ACCEL_BINARY"
+        polls it over the binary protocol.
         """
         # python 3.10 will have switch/case statements; yay...
         print(f"received reverse_coords={reverse_coords}\n")
         self.xy_input_mode = xy_input.upper()
         if self.xy_input_mode == "MOUSE":
+            from psychopy import event
+
             self.__xy_input_object = event.Mouse(visible=True, win=window)
             if reverse_coords is True:
                 self.get_xy_position = self.__get_mouse_position_rev
@@ -104,13 +119,27 @@ class CST_User_Input(object):
                 self.get_xy_position = self.__get_mouse_position
             self.reset_xy_position = self.__reset_mouse_position
 
-        elif self.xy_input_mode == "ACCEL":
-            accel = AccelerometerBase()
-            accel.connect_to_wired(mount_point="search")
+        elif self.xy_input_mode in ("ACCEL", "ACCEL_STREAM", "ACCEL_BINARY"):
+            from CST_Accelerometer_01 import (
+                AccelerometerBase,
+                AccelerometerBinary,
+                AccelerometerStreaming,
+            )
+
+            if self.xy_input_mode == "ACCEL_STREAM":
+                accel = AccelerometerStreaming()
+                accel.connect_to_wired(mount_point="search")
+                accel.start_streaming(stream_hz=stream_hz)
+            elif self.xy_input_mode == "ACCEL_BINARY":
+                accel = AccelerometerBinary()
+                accel.connect_to_wired(mount_point="search")
+            else:
+                accel = AccelerometerBase()
+                accel.connect_to_wired(mount_point="search")
             self.poll_and_update = accel.poll_and_update
             self.poll_and_update()
             self.get_these_values = accel.getPos()
-            #self.shutdown = accel.shutdown()
+            self.shutdown = accel.shutdown
             x, y = accel.getPos()
             self.__xy_input_object = accel
             if reverse_coords is True:
@@ -136,7 +165,25 @@ class CST_User_Input(object):
             self.get_xy_position = self.__get_joystick_xy  # passing func
             self.reset_xy_position = self.__pass_function  # func
 
+    def set_input_filter(self, kind, predict_secs=None, **params):
+        """
+        Filter and predict x from the connected xy device. Call after
+        connect_xy_object; the raw x stays in input_filter.raw_x.
+        """
+        self.input_filter = FilteredInput(
+            self.get_xy_position, kind, predict_secs, **params
+        )
+        self.get_xy_position = self.input_filter.read
+        self.__reset_device_position = self.reset_xy_position
+        self.reset_xy_position = self.__reset_filtered_position
+
+    def __reset_filtered_position(self, *args, **kwargs):
+        self.__reset_device_position(*args, **kwargs)
+        self.input_filter.reset()
+
     def set_joystick(self):
+        from psychopy.hardware import joystick
+
         nJoys = joystick.getNumJoysticks()  # to check if we have any
         joystick_id = nJoys - 1
         joy = joystick.Joystick(joystick_id)
@@ -221,8 +268,188 @@ class null_dev(object):
         return wrapper
 
 
+class DeviceLatencyStats(object):
+    """Per-device call counts and queue/call latencies for MoBI sends."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, device_name, captured_at, started_at, ended_at, failed=False):
+        """Update the counters for one call (perf_counter timestamps)."""
+        s = self.stats.get(device_name)
+        if s is None:
+            s = self.stats[device_name] = {
+                "calls": 0,
+                "errors": 0,
+                "queue_secs_total": 0.0,
+                "queue_secs_max": 0.0,
+                "call_secs_total": 0.0,
+                "call_secs_max": 0.0,
+            }
+        queue_secs = started_at - captured_at
+        call_secs = ended_at - started_at
+        s["calls"] += 1
+        s["errors"] += failed
+        s["queue_secs_total"] += queue_secs
+        s["call_secs_total"] += call_secs
+        if queue_secs > s["queue_secs_max"]:
+            s["queue_secs_max"] = queue_secs
+        if call_secs > s["call_secs_max"]:
+            s["call_secs_max"] = call_secs
+
+    def report(self):
+        """Summary in milliseconds as a dictionary keyed on device."""
+        devices = {}
+        for name, s in self.stats.items():
+            calls = max(s["calls"], 1)
+            devices[name] = {
+                "calls": s["calls"],
+                "errors": s["errors"],
+                "queue_ms_mean": s["queue_secs_total"] / calls * 1000,
+                "queue_ms_max": s["queue_secs_max"] * 1000,
+                "call_ms_mean": s["call_secs_total"] / calls * 1000,
+                "call_ms_max": s["call_secs_max"] * 1000,
+            }
+        return devices
+
+
+class MoBI_Dispatcher(object):
+    """
+    Runs MoBI device calls on a worker thread, off the render thread.
+
+    submit() queues a call with the perf_counter time it was captured at.
+    The worker runs queued calls in order and records their latencies in
+    'latency'. Device errors are counted and warned about, never raised
+    into the task.
+    """
+
+    def __init__(self):
+        self.max_depth = 0
+        self.latency = DeviceLatencyStats()
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(
+            target=self.__run, name="MoBI_Dispatcher", daemon=True
+        )
+        self.__thread.start()
+
+    def submit(self, device_name, func, args, kwargs, captured_at):
+        self.__queue.put_nowait((device_name, func, args, kwargs, captured_at))
+        depth = self.__queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                self.__queue.task_done()
+                break
+            device_name, func, args, kwargs, captured_at = item
+            started_at = time.perf_counter()
+            failed = False
+            try:
+                func(*args, **kwargs)
+            except Exception as err:
+                failed = True
+                warnings.warn(f"MoBI {device_name} call failed: {err}")
+            self.latency.record(
+                device_name, captured_at, started_at, time.perf_counter(), failed
+            )
+            self.__queue.task_done()
+
+    def drain(self):
+        """Block until every queued call has run."""
+        self.__queue.join()
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def report(self):
+        return {"max_queue_depth": self.max_depth, "devices": self.latency.report()}
+
+
+class LSLChunker(object):
+    """
+    Buffers samples for an LSL outlet and sends them with push_chunk,
+    each with its own LSL timestamp, instead of one push_sample per
+    frame.
+
+    The buffer is sent once it holds 'chunk_samples' samples, or when a
+    sample is added 'chunk_ms' or more after the oldest buffered one
+    (0 turns the time limit off). The time limit is checked as samples
+    arrive, so a chunk can wait up to one frame past 'chunk_ms'. With
+    the defaults every sample is sent at once, still timestamped.
+
+    Inputs:
+        outlet        : pylsl StreamOutlet (anything with push_chunk)
+        chunk_samples : samples per chunk
+        chunk_ms      : longest time a sample waits in the buffer
+        clock         : seconds clock for the time limit
+    """
+
+    def __init__(self, outlet, chunk_samples=1, chunk_ms=0, clock=time.perf_counter):
+        self.outlet = outlet
+        self.chunk_samples = max(1, int(chunk_samples))
+        self.chunk_secs = chunk_ms / 1000
+        self.clock = clock
+        self.samples = []
+        self.timestamps = []
+        self.oldest_at = None
+        self.num_samples = 0
+        self.num_chunks = 0
+
+    def push(self, vals, timestamp):
+        """Buffer one sample taken at 'timestamp' (LSL clock)."""
+        now = self.clock()
+        if self.oldest_at is None:
+            self.oldest_at = now
+        self.samples.append(list(vals))
+        self.timestamps.append(timestamp)
+        if len(self.samples) >= self.chunk_samples or (
+            self.chunk_secs > 0 and now - self.oldest_at >= self.chunk_secs
+        ):
+            self.flush()
+
+    def flush(self):
+        """Send whatever is buffered."""
+        if len(self.samples) == 0:
+            return
+        self.outlet.push_chunk(self.samples, self.timestamps)
+        self.num_samples += len(self.samples)
+        self.num_chunks += 1
+        self.samples = []
+        self.timestamps = []
+        self.oldest_at = None
+
+    def report(self):
+        return {
+            "chunk_samples": self.chunk_samples,
+            "chunk_ms": self.chunk_secs * 1000,
+            "num_samples": self.num_samples,
+            "num_chunks": self.num_chunks,
+        }
+
+
 class MoBI_Devices(object):
-    """Writing single object for all MoBI devices we will connect."""
+    """
+    Writing single object for all MoBI devices we will connect.
+
+    Device calls go through send(). With params_dict["dispatch_mode"]
+    set to "async", they run on a MoBI_Dispatcher worker thread, except
+    for devices listed in params_dict["sync_devices"] (default: the
+    "eeg" TTL port), which stay synchronous for trigger timing. In both
+    modes every call is counted in the dispatcher latency statistics.
+    Queued push_sample calls without a timestamp are stamped with the
+    LSL clock time they were sent at, not the time the worker runs them.
+
+    Task values go to the "cpCST" outlet through an LSLChunker
+    ("lsl_chunker"), timestamped with lsl_time(flip_time); the flush
+    policy comes from params_dict["lsl_chunk_samples"] and
+    ["lsl_chunk_ms"]. Onset, crash and end events go to a separate
+    irregular-rate string stream, "cpCST_markers" ("marker_outlet"),
+    one sample per event, sent at once.
+    """
 
     def __init__(
         self,
@@ -242,7 +469,7 @@ class MoBI_Devices(object):
         try:
             # if lsltools available grab the reference
             import stimlsltools as slt
-            from pylsl import StreamInfo, StreamOutlet
+            from pylsl import StreamInfo, StreamOutlet, local_clock
 
             self.slt = slt
             info = StreamInfo(
@@ -266,17 +493,33 @@ class MoBI_Devices(object):
 
             self.lsl_outlet = StreamOutlet(info)
 
+            marker_info = StreamInfo(
+                "cpCST_markers",
+                "Markers",
+                1,
+                0,  # irregular rate
+                "string",
+                f"{params_dict['UID']}_markers",
+            )
+            self.marker_outlet = StreamOutlet(marker_info)
+            self.local_clock = local_clock
+            self.hasLSL = True
+
         except ModuleNotFoundError:
             # if not, pass a null function so that
             # the code can run.
             self.hasLSL = False
             self.slt = self.null_dev
             self.lsl_outlet = self.null_dev
+            self.marker_outlet = self.null_dev
+            self.local_clock = time.perf_counter
             warnings.warn(
                 "Error Loading LSL. Lab Streaming Layer will not be available."
             )
 
         if params_dict["withEEG"] is True:
+            from psychopy import parallel
+
             try:
                 print(params_dict["eeg_portAddress"])
                 self.eeg = parallel.ParallelPort(address=params_dict["eeg_portAddress"])
@@ -290,6 +533,8 @@ class MoBI_Devices(object):
 
         if params_dict["withEyetracker"] is True:
             try:
+                from pygaze.eyetracker import EyeTracker
+
                 self.eyetracker = EyeTracker(
                     params_dict["display"],
                     trackertype="eyelink",
@@ -303,8 +548,82 @@ class MoBI_Devices(object):
         else:
             self.eyetracker = self.null_dev
 
+        self.configure_dispatch(params_dict)
+        self.configure_chunks(params_dict)
+
         self.is_configured = True
 
+    def configure_chunks(self, params_dict):
+        if self.hasLSL is True:
+            self.lsl_chunker = LSLChunker(
+                self.lsl_outlet,
+                params_dict.get("lsl_chunk_samples", 1),
+                params_dict.get("lsl_chunk_ms", 0),
+            )
+        else:
+            self.lsl_chunker = self.null_dev
+        self.lsl_offset = 0.0
+
+    def map_clock(self, exp_clock):
+        """
+        Store the offset from 'exp_clock' (the task clock, just reset)
+        to the LSL clock, read as close together as possible.
+        """
+        before = self.local_clock()
+        exp_time = exp_clock.getTime()
+        after = self.local_clock()
+        self.lsl_offset = (before + after) / 2 - exp_time
+
+    def lsl_time(self, exp_time):
+        """Task clock time as LSL clock time."""
+        return exp_time + self.lsl_offset
+
+    def configure_dispatch(self, params_dict):
+        self.dispatch_mode = params_dict.get("dispatch_mode", "sync")
+        self.sync_devices = set(params_dict.get("sync_devices", ("eeg",)))
+        if self.dispatch_mode == "async":
+            self.dispatcher = MoBI_Dispatcher()
+        else:
+            self.dispatcher = None
+        self.sync_latency = DeviceLatencyStats()
+
+    def send(self, device_name, method_name, *args, **kwargs):
+        """
+        Call 'method_name' on the named device (e.g. "eeg", "slt",
+        "lsl_outlet", "eyetracker"), now or on the dispatch thread.
+        """
+        func = getattr(getattr(self, device_name), method_name)
+        captured_at = time.perf_counter()
+        if self.dispatcher is None or device_name in self.sync_devices:
+            func(*args, **kwargs)
+            self.sync_latency.record(
+                device_name, captured_at, captured_at, time.perf_counter()
+            )
+        else:
+            if method_name == "push_sample" and len(args) < 2:
+                kwargs.setdefault("timestamp", self.local_clock())
+            self.dispatcher.submit(device_name, func, args, kwargs, captured_at)
+
+    def drain_dispatch(self):
+        """Wait until queued calls have run; the dispatch thread stays."""
+        if self.dispatcher is not None:
+            self.dispatcher.drain()
+
+    def close_dispatch(self):
+        """Run any queued calls and stop the dispatch thread."""
+        if self.dispatcher is not None:
+            self.dispatcher.drain()
+            self.dispatcher.close()
+
+    def dispatch_report(self):
+        report = {"dispatch_mode": self.dispatch_mode}
+        report["sync"] = self.sync_latency.report()
+        if self.dispatcher is not None:
+            report["async"] = self.dispatcher.report()
+        if isinstance(self.lsl_chunker, LSLChunker):
+            report["lsl_chunks"] = self.lsl_chunker.report()
+        return report
+
 
 class CST_Device_IO(object):
     """
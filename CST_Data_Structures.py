@@ -133,9 +133,15 @@ class TaskParameters(Parameters):
         # Set some basic params to reasonable values.
         self.param_desc = "Task Parameters"
         self.OUTPUT_STEM = ""
+        # session log format: "csv", "parquet", "feather" or "hdf5"
+        self.OUTPUT_FORMAT = "csv"
         self.SUBID = ""
         self.TASK_LOOP_RATE = 1 / 30
         self.TASK_SAMPLE_HZ = 30
+        # > 0: step model and input at this fixed rate, independent of
+        # the display; per-step change is scaled to PHYSICS_REFERENCE_HZ
+        self.PHYSICS_HZ = 0
+        self.PHYSICS_REFERENCE_HZ = 30
         self.LAMBDA_INIT = 0.125
         self.NOISE_LEVEL = 0.0075
         self.LAMBDA_SLOPE_INIT = 20
@@ -146,6 +152,7 @@ class TaskParameters(Parameters):
         self.TASK_MODE = "CALIBRATE"
 
         self.XY_INPUT_MODE = "MOUSE"
+        self.ACCEL_STREAM_HZ = 40
         self.PRESS_INPUT_MODE = "KB"
         self.MOVING_TARGET = False
         self.TARGET_TRAJECTORY = "STATIC"
@@ -156,6 +163,29 @@ class TaskParameters(Parameters):
         self.USE_TIME_OFF_TARGET = False
 
         self.CPT_PROP_OF_MAX = 0.5
+        # calibration lambda_c history; None = calibration_lambdas.csv only
+        self.CALIBRATION_DB = "calibration_lambdas.sqlite"
+
+        # flips later than this (seconds) are reported as late;
+        # None = half of TASK_LOOP_RATE
+        self.LATE_FLIP_SECS = None
+        # flips used to measure the refresh period at startup;
+        # 0 = don't measure, and don't snap flips to the refresh
+        self.REFRESH_MEASURE_FRAMES = 60
+
+        # seed for the drift direction after resets; None = pick one
+        # per run (it is saved in the _replay.json, see CST_Replay)
+        self.RANDOM_SEED = None
+
+        # draw the static background from a pre-rendered image
+        self.RETAINED_RENDERING = False
+
+        # filter for the xy input: None, "kalman" or "one_euro", with
+        # optional settings (see CST_InputFilters); x is extrapolated by
+        # INPUT_PREDICT_SECS, None = the measured read-to-flip latency
+        self.INPUT_FILTER = None
+        self.INPUT_FILTER_PARAMS = {}
+        self.INPUT_PREDICT_SECS = None
 
         self.SHOW_FIXATION = True
         self.SHOW_SCORE = True
@@ -207,6 +237,7 @@ class StateValues(Parameters):
         self.user_id = "rs2_12345"
         self.stim_pos = 0.0  # The moving disk thingy
         self.user_pos = 0.0  # The mouse/joystick, etc. position
+        self.user_pos_raw = 0.0  # user_pos before INPUT_FILTER
         self.target_pos = [0.0, 0.0]  # Where we are trying to get the stimulus
         self.stim_to_center_dist = 0.0
 
@@ -227,6 +258,7 @@ class StateValues(Parameters):
 
         self.expected_time = 0.0
         self.flip_time = 0.0
+        self.flip_error = 0.0  # flip_time minus the vblank it was scheduled for
 
         self.stop_run = False
         self.did_crash = False
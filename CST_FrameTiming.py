@@ -0,0 +1,211 @@
+import json
+import time
+import warnings
+
+import numpy as np
+
+# Phases of one StateMachine.run iteration, in the order they happen.
+PHASES = (
+    "input",
+    "mobi",
+    "logic",
+    "pause",
+    "physics",
+    "draw",
+    "wait",
+    "flip",
+    "log",
+    "model",
+)
+INPUT, MOBI, LOGIC, PAUSE, PHYSICS, DRAW, WAIT, FLIP, LOG, MODEL = range(len(PHASES))
+
+
+class FrameTimer(object):
+    """
+    Per-frame phase timestamps for the task loop.
+
+    Each loop iteration calls start_frame(), then mark(PHASE) as each
+    phase finishes, then end_frame() with the expected and actual flip
+    times. Timestamps go into a preallocated (frames x phases) array, so
+    timing itself costs one perf_counter() call and one store per phase.
+    If a run has more frames than 'capacity', the oldest frames are
+    overwritten.
+
+    Methods:
+        summary(late_threshold) returns percentiles per phase and the
+                    list of frames whose flip came later than
+                    'late_threshold' seconds after the expected time.
+        write_summary(path, ...) writes the summary as JSON.
+    """
+
+    def __init__(self, capacity=1):
+        self.capacity = int(capacity)
+        self.stamps = np.zeros((self.capacity, len(PHASES) + 1))
+        self.expected = np.zeros(self.capacity)
+        self.flipped = np.zeros(self.capacity)
+        self.num_frames = 0
+        self.__row = self.stamps[0]
+
+    def start_frame(self):
+        self.__row = self.stamps[self.num_frames % self.capacity]
+        self.__row[0] = time.perf_counter()
+
+    def mark(self, phase):
+        self.__row[phase + 1] = time.perf_counter()
+
+    def end_frame(self, expected_time, flip_time):
+        row = self.num_frames % self.capacity
+        self.expected[row] = expected_time
+        self.flipped[row] = flip_time
+        self.num_frames += 1
+
+    def __ordered(self, values):
+        """Stored frames, oldest first."""
+        n = min(self.num_frames, self.capacity)
+        start = max(0, self.num_frames - self.capacity)
+        idx = np.arange(start, start + n) % self.capacity
+        return values[idx]
+
+    @staticmethod
+    def percentiles(values_ms):
+        if len(values_ms) == 0:
+            return {}
+        p50, p90, p99 = np.percentile(values_ms, [50, 90, 99])
+        return {
+            "mean_ms": float(values_ms.mean()),
+            "p50_ms": float(p50),
+            "p90_ms": float(p90),
+            "p99_ms": float(p99),
+            "max_ms": float(values_ms.max()),
+        }
+
+    def summary(self, late_threshold):
+        stamps = self.__ordered(self.stamps)
+        durations = np.diff(stamps, axis=1) * 1000
+        frame_ms = (stamps[:, -1] - stamps[:, 0]) * 1000
+        expected = self.__ordered(self.expected)
+        flip_error_ms = (self.__ordered(self.flipped) - expected) * 1000
+        first_frame = max(0, self.num_frames - self.capacity)
+
+        late_frames = []
+        for k in np.flatnonzero(flip_error_ms > late_threshold * 1000):
+            late_frames.append(
+                {
+                    "frame": int(first_frame + k),
+                    "expected_time": float(expected[k]),
+                    "flip_error_ms": float(flip_error_ms[k]),
+                    "slowest_phase": PHASES[int(np.argmax(durations[k]))],
+                    "phase_ms": dict(zip(PHASES, durations[k].round(3).tolist())),
+                }
+            )
+
+        return {
+            "num_frames": int(self.num_frames),
+            "frames_summarized": int(len(frame_ms)),
+            "late_threshold_ms": late_threshold * 1000,
+            "frame": self.percentiles(frame_ms),
+            "flip_error": self.percentiles(flip_error_ms),
+            "phases": {
+                p: self.percentiles(durations[:, k]) for k, p in enumerate(PHASES)
+            },
+            "num_late_frames": len(late_frames),
+            "late_frames": late_frames,
+        }
+
+    def write_summary(self, file_path, late_threshold, extra=None):
+        """Write summary() as JSON, with any 'extra' entries added."""
+        summary = self.summary(late_threshold)
+        if extra is not None:
+            summary.update(extra)
+        with open(file_path, "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+class FlipScheduler(object):
+    """
+    Waits for flip targets with a coarse sleep and a short spin, and
+    snaps the targets to the display refresh grid.
+
+    measure_refresh() flips the display repeatedly and takes the median
+    interval as the refresh period. With the period known, target()
+    moves a requested onset to the nearest vblank after the last flip,
+    and wait_for() ends half a period before that vblank (issue_time()),
+    so the (blocking) flip lands on it. Without a period, the target is
+    the onset itself and the wait ends 'flip_lead' seconds before it.
+
+    Waits whose deadline has already passed return at once and are
+    counted in 'num_missed'.
+    """
+
+    def __init__(self, spin_secs=0.002, flip_lead=0.005):
+        self.spin_secs = spin_secs
+        self.flip_lead = flip_lead
+        self.refresh_period = None
+        self.refresh_sd = None
+        self.last_flip = None
+        self.num_waits = 0
+        self.num_missed = 0
+
+    def measure_refresh(self, flip, num_frames=60, num_warmup=10):
+        """
+        Estimate the refresh period from 'num_frames' calls to 'flip',
+        which must block until the vblank and return its time in seconds.
+        """
+        stamps = [flip() for _ in range(num_warmup + num_frames + 1)]
+        intervals = np.diff(stamps[num_warmup:])
+        period = float(np.median(intervals))
+        if not 1 / 500 <= period <= 1 / 20:
+            warnings.warn(
+                f"Measured refresh period of {period * 1000:.2f} ms is not "
+                "plausible; flips will not be snapped to the refresh."
+            )
+            return None
+        self.refresh_period = period
+        self.refresh_sd = float(intervals.std())
+        return period
+
+    def reset(self):
+        """Forget the last flip, e.g. when the run clock is reset."""
+        self.last_flip = None
+
+    def target(self, at_time):
+        """Flip time to aim for: 'at_time' snapped to the refresh grid."""
+        if self.refresh_period is None or self.last_flip is None:
+            return at_time
+        frames = max(1, round((at_time - self.last_flip) / self.refresh_period))
+        return self.last_flip + frames * self.refresh_period
+
+    def issue_time(self, target):
+        """When to issue the flip for 'target'."""
+        if self.refresh_period is None:
+            return target - self.flip_lead
+        return target - self.refresh_period / 2
+
+    def wait_for(self, clock, target):
+        """Sleep, then spin, until it is time to issue the flip for 'target'."""
+        deadline = self.issue_time(target)
+        self.num_waits += 1
+        remaining = deadline - clock.getTime()
+        if remaining <= 0:
+            self.num_missed += 1
+            return
+        if remaining > self.spin_secs:
+            time.sleep(remaining - self.spin_secs)
+        while clock.getTime() < deadline:
+            pass
+
+    def flipped(self, flip_time):
+        self.last_flip = flip_time
+
+    def report(self):
+        return {
+            "refresh_period_ms": (
+                None if self.refresh_period is None else self.refresh_period * 1000
+            ),
+            "refresh_sd_ms": (
+                None if self.refresh_sd is None else self.refresh_sd * 1000
+            ),
+            "num_waits": self.num_waits,
+            "num_missed_deadlines": self.num_missed,
+        }
@@ -0,0 +1,208 @@
+import time
+
+import numpy as np
+
+from CST_DataIO_pygaze import MoBI_Devices
+from CST_InputFilters import FilteredInput
+from CST_FrameTiming import (
+    DRAW,
+    FLIP,
+    PAUSE,
+    PHYSICS,
+    WAIT,
+    FlipScheduler,
+    FrameTimer,
+)
+
+
+class HeadlessClock(object):
+    """
+    Stand-in for psychopy.core.Clock on time.perf_counter: getTime()
+    is seconds since the last reset(), plus 'newT'.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+
+    def getTime(self):
+        return time.perf_counter() - self.started_at
+
+    def reset(self, newT=0.0):
+        self.started_at = time.perf_counter() - newT
+
+
+class SimulatedParticipant(object):
+    """
+    Stand-in for CST_User_Input. Pushes against the stimulus like a
+    participant would: user_pos = -gain * stim_pos plus a little noise,
+    so the stimulus stays near the center at moderate lambda.
+    """
+
+    def __init__(self, state_params, gain=1.2, noise=0.002, seed=0):
+        self.state_params = state_params
+        self.gain = gain
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+        self.input_filter = None
+
+    def get_xy_position(self):
+        x = -self.gain * self.state_params.stim_pos + self.rng.normal(0, self.noise)
+        return [x, 0.0]
+
+    def set_input_filter(self, kind, predict_secs=None, **params):
+        self.input_filter = FilteredInput(
+            self.get_xy_position, kind, predict_secs, **params
+        )
+        self.get_xy_position = self.input_filter.read
+
+    def reset_xy_position(self, newPos=0):
+        if self.input_filter is not None:
+            self.input_filter.reset()
+
+    def shutdown(self):
+        pass
+
+
+class HeadlessViewModel(object):
+    """
+    Stand-in for ViewModel with no window.
+
+    Follows the ViewModel timing contract: update_and_flip_at() handles a
+    pending crash, waits for 'at_time' with a FlipScheduler and returns
+    the "flip" time on the experiment clock. With 'refresh_hz' set, a
+    flip blocks until the next tick of a simulated vsync grid, and the
+    scheduler measures and snaps to that grid. 'draw_secs' busy-waits to
+    stand in for drawing cost; 'crash_pause' sleeps in place of the
+    error and reset screens.
+    """
+
+    def __init__(self, refresh_hz=None, draw_secs=0.0, crash_pause=0.0):
+        self.disp = None
+        self.task_params = None
+        self.state_params = None
+        self.cst_user_input = None
+        self.refresh_hz = refresh_hz
+        self.draw_secs = draw_secs
+        self.crash_pause = crash_pause
+        self.rng = np.random.RandomState()  # seeded per run, as in ViewModel
+        self.frame_timer = FrameTimer()
+        self.pause_secs = 0.0
+        # without vsync the "flip" does not block, so no lead is needed
+        self.flip_scheduler = FlipScheduler(
+            flip_lead=0.005 if refresh_hz is not None else 0.0
+        )
+        self.flip_target = 0.0
+        self.schedule = None
+        self.physics = None
+
+    def set_parameters(self, task_params, state_params):
+        self.task_params = task_params
+        self.state_params = state_params
+        self.cst_user_input = SimulatedParticipant(state_params)
+        if task_params.INPUT_FILTER is not None:
+            self.cst_user_input.set_input_filter(
+                task_params.INPUT_FILTER,
+                task_params.INPUT_PREDICT_SECS,
+                **task_params.INPUT_FILTER_PARAMS,
+            )
+        num_frames = task_params.REFRESH_MEASURE_FRAMES
+        if self.refresh_hz is not None and num_frames > 0:
+            if self.flip_scheduler.refresh_period is None:
+                self.flip_scheduler.measure_refresh(self.vsync, num_frames)
+
+    def reset_position(self):
+        direction = -1 if self.rng.randint(0, 2, 1) else 1
+        self.state_params.stim_pos = 0.005 * direction
+        self.state_params.user_pos = 0.0
+        self.cst_user_input.reset_xy_position()
+
+    def initialize_stim(self):
+        self.reset_position()
+        self.flip_scheduler.reset()
+
+    def reset_stim(self):
+        self.reset_position()
+
+    def show_instructions(self, message_str=None):
+        pass
+
+    @staticmethod
+    def spin_until(deadline):
+        """Sleep, then spin for the last 2 ms, until perf_counter >= deadline."""
+        remaining = deadline - time.perf_counter()
+        if remaining > 0.002:
+            time.sleep(remaining - 0.002)
+        while time.perf_counter() < deadline:
+            pass
+
+    def vsync(self):
+        """Block until the next tick of the simulated vsync grid."""
+        if self.refresh_hz is not None:
+            period = 1.0 / self.refresh_hz
+            self.spin_until((time.perf_counter() // period + 1) * period)
+        return time.perf_counter()
+
+    def update_and_flip_at(self, exp_clock, at_time):
+        self.pause_secs = 0.0
+        if self.state_params.is_OOB is True:
+            start_pause = exp_clock.getTime()
+            self.state_params.did_crash = True
+            time.sleep(self.crash_pause)
+            self.reset_stim()
+            self.state_params.is_OOB = False
+            end_pause = exp_clock.getTime()
+            if self.physics is not None:
+                # step on from the reset stimulus
+                self.physics.reset(end_pause)
+            elapsed_time = end_pause - start_pause
+            self.schedule.add_pause(start_pause, end_pause)
+            at_time += elapsed_time
+            self.pause_secs = elapsed_time
+        self.frame_timer.mark(PAUSE)
+
+        self.flip_target = self.flip_scheduler.target(at_time)
+        if self.physics is not None:
+            self.physics.run_until(
+                exp_clock,
+                self.flip_scheduler.issue_time(self.flip_target)
+                - self.physics.render_lead,
+            )
+        self.frame_timer.mark(PHYSICS)
+
+        self.spin_until(time.perf_counter() + self.draw_secs)
+        self.frame_timer.mark(DRAW)
+        self.flip_scheduler.wait_for(exp_clock, self.flip_target)
+        self.frame_timer.mark(WAIT)
+        self.vsync()
+        self.frame_timer.mark(FLIP)
+
+        flip_time = exp_clock.getTime()
+        self.flip_scheduler.flipped(flip_time)
+        return flip_time
+
+
+class QuietDevice(object):
+    """Like null_dev, but accepts every call silently."""
+
+    def __getattr__(self, name):
+        def wrapper(*args, **kwargs):
+            pass
+
+        return wrapper
+
+
+class HeadlessMoBI(MoBI_Devices):
+    """MoBI_Devices with every device replaced by a QuietDevice."""
+
+    def __init__(self, params_dict):
+        self.null_dev = QuietDevice()
+        self.hasLSL = False
+        self.slt = self.null_dev
+        self.lsl_outlet = self.null_dev
+        self.marker_outlet = self.null_dev
+        self.local_clock = time.perf_counter
+        self.eeg = self.null_dev
+        self.eyetracker = self.null_dev
+        self.configure_dispatch(params_dict)
+        self.configure_chunks(params_dict)
+        self.is_configured = True
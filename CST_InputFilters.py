@@ -0,0 +1,181 @@
+"""
+Filtering and latency prediction for the xy input.
+
+The position read at the top of a frame is shown at the next flip, a
+few ms later, and accelerometer reads are noisy from sample to sample.
+FilteredInput wraps a get_xy_position function: it filters x with a
+constant-velocity Kalman filter or a One-Euro filter, then extrapolates
+it with the filter's velocity estimate to when the frame will flip,
+using the measured read-to-flip latency. y is passed through; only x
+drives the task. The filters are scalar float math, a few microseconds
+per read.
+"""
+
+import math
+import time
+
+
+class KalmanCV(object):
+    """
+    Constant-velocity Kalman filter on one axis. The state is position
+    and velocity; acceleration is white noise.
+
+    Inputs:
+        process_noise     : acceleration variance, (units/s^2)^2
+        measurement_noise : position read variance, units^2
+    """
+
+    def __init__(self, process_noise=5.0, measurement_noise=1e-4):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+
+    def reset(self, x=0.0):
+        self.pos = x
+        self.vel = 0.0
+        # covariance [[p00, p01], [p01, p11]]; unknown velocity at start
+        self.p00 = self.r
+        self.p01 = 0.0
+        self.p11 = 1.0
+        self.t = None
+
+    def update(self, x, t):
+        """Filter the read 'x' taken at 't'; returns (pos, vel)."""
+        if self.t is None:
+            self.pos = x
+            self.t = t
+            return self.pos, self.vel
+        dt = t - self.t
+        self.t = t
+        if dt > 0:
+            # predict
+            self.pos += self.vel * dt
+            q = self.q
+            dt2 = dt * dt
+            p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt2 * dt2 / 4
+            p01 = self.p01 + dt * self.p11 + q * dt2 * dt / 2
+            p11 = self.p11 + q * dt2
+        else:
+            p00, p01, p11 = self.p00, self.p01, self.p11
+        # correct
+        s = p00 + self.r
+        k0 = p00 / s
+        k1 = p01 / s
+        innovation = x - self.pos
+        self.pos += k0 * innovation
+        self.vel += k1 * innovation
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+        return self.pos, self.vel
+
+
+class OneEuroFilter(object):
+    """
+    One-Euro filter (Casiez et al., 2012) on one axis: a low-pass
+    filter whose cutoff rises with speed, so it smooths jitter when
+    still and adds little lag when moving.
+
+    Inputs:
+        min_cutoff : cutoff in Hz when still
+        beta       : cutoff increase per unit/s of speed
+        d_cutoff   : cutoff in Hz of the velocity estimate
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self, x=0.0):
+        self.pos = x
+        self.vel = 0.0
+        self.t = None
+
+    @staticmethod
+    def alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def update(self, x, t):
+        """Filter the read 'x' taken at 't'; returns (pos, vel)."""
+        if self.t is None:
+            self.pos = x
+            self.t = t
+            return self.pos, self.vel
+        dt = t - self.t
+        if dt <= 0:
+            return self.pos, self.vel
+        self.t = t
+        a_d = self.alpha(self.d_cutoff, dt)
+        self.vel += a_d * ((x - self.pos) / dt - self.vel)
+        cutoff = self.min_cutoff + self.beta * abs(self.vel)
+        self.pos += self.alpha(cutoff, dt) * (x - self.pos)
+        return self.pos, self.vel
+
+
+FILTERS = {"kalman": KalmanCV, "one_euro": OneEuroFilter}
+
+
+class FilteredInput(object):
+    """
+    get_xy_position wrapper that filters and predicts x.
+
+    read() returns [x, y] like the wrapped function, with x filtered
+    and extrapolated by 'predict_secs', or, if that is None, by the
+    measured latency: a running average of the time from a read to the
+    flip after it, which flipped() records. predict_secs=0 filters
+    without predicting. The last unfiltered x is kept in 'raw_x'.
+
+    Inputs:
+        read_xy      : the device's get_xy_position
+        kind         : "kalman" or "one_euro"
+        predict_secs : fixed prediction lead, or None to measure it
+        clock        : seconds clock for read and flip times
+        **params     : filter settings (see KalmanCV, OneEuroFilter)
+    """
+
+    def __init__(
+        self,
+        read_xy,
+        kind="kalman",
+        predict_secs=None,
+        clock=time.perf_counter,
+        **params,
+    ):
+        if kind not in FILTERS:
+            raise ValueError(f"Input filter {kind} not supported.")
+        self.read_xy = read_xy
+        self.filter = FILTERS[kind](**params)
+        self.predict_secs = predict_secs
+        self.clock = clock
+        self.raw_x = 0.0
+        self.read_at = None
+        self.latency = 0.0
+        self.max_latency = 0.1  # ignore reads across a crash pause
+
+    def read(self):
+        x, y = self.read_xy()
+        now = self.clock()
+        self.raw_x = x
+        self.read_at = now
+        pos, vel = self.filter.update(x, now)
+        lead = self.latency if self.predict_secs is None else self.predict_secs
+        return [pos + vel * lead, y]
+
+    def flipped(self):
+        """Record the latency from the last read to this flip."""
+        if self.read_at is None:
+            return
+        latency = self.clock() - self.read_at
+        if latency >= self.max_latency:
+            return
+        if self.latency == 0.0:
+            self.latency = latency
+        else:
+            self.latency += 0.1 * (latency - self.latency)
+
+    def reset(self, x=0.0):
+        self.filter.reset(x)
+        self.read_at = None
@@ -0,0 +1,183 @@
+"""
+Local stand-in for the LSL outlets and stimlsltools stream labels.
+
+Has the interface MoBI_Devices uses (StreamOutlet.push_sample and
+push_chunk, slt.pushToStreamLabel), but records every sample, marker
+and label with its timestamp in an in-memory ring instead of sending
+it, so the streaming path of StateMachine can be measured and checked
+on a machine with no pylsl, stimlsltools or lab network.
+
+    recorder = LSLRecorder()
+    sm = StateMachine(mobi_factory=StandinMoBI.factory(recorder), ...)
+    sm.run()
+    recorder.report()
+    recorder.save("streams.csv")
+"""
+
+import csv
+import time
+from collections import deque
+
+import numpy as np
+
+from CST_Headless import HeadlessMoBI
+
+
+class StreamStats(object):
+    """Calls, samples and time spent for one stand-in stream."""
+
+    def __init__(self):
+        self.num_calls = 0
+        self.num_samples = 0
+        self.call_secs = 0.0
+        self.first_at = None
+        self.last_at = None
+        self.delays = []  # receipt time - sample timestamp
+
+    def record(self, num_samples, started_at, ended_at, delays):
+        self.num_calls += 1
+        self.num_samples += num_samples
+        self.call_secs += ended_at - started_at
+        if self.first_at is None:
+            self.first_at = started_at
+        self.last_at = ended_at
+        self.delays.extend(delays)
+
+    def report(self):
+        span = 0.0 if self.first_at is None else self.last_at - self.first_at
+        delays = np.array(self.delays) * 1000
+        report = {
+            "num_calls": self.num_calls,
+            "num_samples": self.num_samples,
+            "samples_per_call": self.num_samples / max(self.num_calls, 1),
+            "us_per_call": self.call_secs / max(self.num_calls, 1) * 1e6,
+            "samples_per_sec": self.num_samples / span if span > 0 else None,
+        }
+        if len(delays) > 0:
+            report["delay_ms"] = {
+                "p50": float(np.percentile(delays, 50)),
+                "p99": float(np.percentile(delays, 99)),
+                "max": float(delays.max()),
+            }
+        return report
+
+
+class LSLRecorder(object):
+    """
+    Ring of everything pushed to the stand-in streams, as
+    (stream, timestamp, received_at, values) records, plus per-stream
+    StreamStats. Once 'max_records' are held, the oldest are dropped;
+    the stats still count them.
+
+    Inputs:
+        max_records : ring size
+        clock       : seconds clock; also the stand-in LSL clock
+    """
+
+    def __init__(self, max_records=100000, clock=time.perf_counter):
+        self.clock = clock
+        self.records = deque(maxlen=max_records)
+        self.stats = {}
+
+    def local_clock(self):
+        return self.clock()
+
+    def add(self, stream, samples, timestamps, started_at):
+        received_at = self.clock()
+        for values, timestamp in zip(samples, timestamps):
+            self.records.append((stream, timestamp, received_at, values))
+        if stream not in self.stats:
+            self.stats[stream] = StreamStats()
+        self.stats[stream].record(
+            len(samples),
+            started_at,
+            self.clock(),
+            [received_at - t for t in timestamps],
+        )
+
+    def outlet(self, name):
+        return StandinOutlet(self, name)
+
+    def stream(self, name):
+        """(timestamps, values) of the records still in the ring."""
+        rows = [(r[1], r[3]) for r in self.records if r[0] == name]
+        return [r[0] for r in rows], [r[1] for r in rows]
+
+    def report(self):
+        return {name: stats.report() for name, stats in self.stats.items()}
+
+    def save(self, file_path):
+        """Write the ring as CSV: stream, timestamp, received_at, values."""
+        with open(file_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["stream", "timestamp", "received_at", "values"])
+            for stream, timestamp, received_at, values in self.records:
+                writer.writerow(
+                    [stream, timestamp, received_at, ";".join(map(str, values))]
+                )
+
+
+class StandinOutlet(object):
+    """
+    Records into an LSLRecorder like a pylsl StreamOutlet would send. A
+    timestamp of 0 means "now", as in pylsl; push_chunk takes one
+    timestamp for the last sample or one per sample.
+    """
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def push_sample(self, x, timestamp=0.0, pushthrough=True):
+        started_at = self.recorder.clock()
+        if timestamp == 0.0:
+            timestamp = started_at
+        self.recorder.add(self.name, [list(x)], [timestamp], started_at)
+
+    def push_chunk(self, x, timestamp=0.0, pushthrough=True):
+        started_at = self.recorder.clock()
+        if np.ndim(timestamp) == 0:
+            # pylsl stamps the last sample and back-dates the rest
+            timestamp = [timestamp or started_at] * len(x)
+        self.recorder.add(self.name, [list(v) for v in x], list(timestamp), started_at)
+
+    def have_consumers(self):
+        return True
+
+
+class StandinStreamLabel(object):
+    """Stands in for the stimlsltools module."""
+
+    def __init__(self, recorder, name="cpCST_labels"):
+        self.recorder = recorder
+        self.name = name
+
+    def pushToStreamLabel(self, label):
+        started_at = self.recorder.clock()
+        self.recorder.add(self.name, [[label]], [started_at], started_at)
+
+
+class StandinMoBI(HeadlessMoBI):
+    """
+    HeadlessMoBI with the LSL outlets, marker stream and stream labels
+    recorded by an LSLRecorder. EEG and eyetracker stay quiet.
+    """
+
+    def __init__(self, params_dict, recorder=None):
+        super().__init__(params_dict)
+        self.recorder = LSLRecorder() if recorder is None else recorder
+        self.hasLSL = True
+        self.slt = StandinStreamLabel(self.recorder)
+        self.lsl_outlet = self.recorder.outlet("cpCST")
+        self.marker_outlet = self.recorder.outlet("cpCST_markers")
+        self.local_clock = self.recorder.local_clock
+        self.configure_chunks(params_dict)
+
+    @classmethod
+    def factory(cls, recorder):
+        """mobi_factory for StateMachine that records into 'recorder'."""
+
+        def make(params_dict):
+            return cls(params_dict, recorder)
+
+        return make
@@ -0,0 +1,258 @@
+"""
+Deterministic replay of recorded CST sessions.
+
+Feeds the user_pos recorded in an _events CSV back through CST_Model,
+with no waits, and checks that the model reproduces the logged
+trajectory frame by frame. Reports the first frame and field that
+diverge. Use it to check that model changes keep archived sessions
+reproducible:
+
+    python CST_Replay.py Output/sub-*/ses-*/raw/*_task-CPT*_events.csv
+    python CST_Replay.py --jobs 8 --tolerance 1e-12 sessions/*_events.csv
+
+The task writes a '<stem>_replay.json' next to each _events CSV with the
+initial state, the task settings the loop depends on and the random
+seed for the reset directions. Without it, the initial state is taken
+from the log and the reset positions from the crash frames, which
+still checks the model itself.
+"""
+
+import argparse
+import glob
+import json
+import os
+from multiprocessing import Pool
+from pathlib import Path
+
+import numpy as np
+
+from CST_Calculations import CST_Model
+from CST_Data_Structures import TaskParameters
+from CST_Schema import StateRecord
+from CST_SessionLog import OUTPUT_EXTENSIONS, read_session_log
+
+# task settings the frame loop depends on, saved in the _replay.json
+REPLAY_TASK_FIELDS = [
+    "TASK_MODE",
+    "MAX_BOUNDS",
+    "NUM_TEST_TRIALS",
+    "SCALE_VALS",
+    "RANDOM_SEED",
+    "PHYSICS_HZ",
+]
+EXTENSIONS = tuple(OUTPUT_EXTENSIONS.values())
+# logged values compared on every frame
+REPLAY_FIELDS = [
+    "stim_pos",
+    "user_pos",
+    "lambda_val",
+    "change_rate_x",
+    "crash_count",
+    "did_crash",
+    "lambda_slope",
+]
+
+
+def replay_info_path(events_path):
+    stem = str(events_path)
+    if stem.endswith(".part"):
+        stem = stem[: -len(".part")]
+    stem = os.path.splitext(stem)[0] if stem.endswith(EXTENSIONS) else stem
+    if stem.endswith("_events"):
+        stem = stem[: -len("_events")]
+    return f"{stem}_replay.json"
+
+
+def write_replay_info(file_path, task_params, state_params, seed=None):
+    """
+    Save what a replay needs, before the first frame of a run. 'seed'
+    is the run's reset-direction seed, if not task_params.RANDOM_SEED.
+    """
+    info = {
+        "task": {k: getattr(task_params, k) for k in REPLAY_TASK_FIELDS},
+        "state": state_params.as_dict(),
+    }
+    if seed is not None:
+        info["task"]["RANDOM_SEED"] = seed
+    with open(file_path, "w") as f:
+        json.dump(info, f, indent=2, default=float)
+
+
+class SessionReplay(object):
+    """
+    Replays one _events CSV through CST_Model.
+
+    Each frame runs the same steps as StateMachine.run, minus input,
+    drawing and waiting: take the logged user_pos, handle a crash the
+    way the loop does (lambda update, reset to a random side), compare
+    the state with the logged row, then update the model using the
+    logged flip_time. The extra record written at stop is compared
+    against the state after the last model update.
+
+    Inputs:
+        events_path : _events file (CSV, .part or columnar) to replay
+        info_path   : _replay.json; default is the one next to the CSV.
+                      If there is none, the initial state comes from the
+                      first rows of the log and reset positions from the
+                      crash frames.
+        tolerance   : largest absolute difference counted as a match
+    """
+
+    def __init__(self, events_path, info_path=None, tolerance=0.0):
+        self.events_path = str(events_path)
+        if info_path is None:
+            info_path = replay_info_path(self.events_path)
+        self.info_path = info_path if Path(info_path).exists() else None
+        self.tolerance = tolerance
+
+    def initial_params(self, log):
+        task_params = TaskParameters()
+        state_params = StateRecord()
+        if self.info_path is not None:
+            with open(self.info_path, "r") as f:
+                info = json.load(f)
+            task_params.update_dict(info["task"])
+            state_params.update_dict(info["state"])
+            return task_params, state_params
+
+        # no saved state: start from the first record
+        task_params.TASK_MODE = "CPT"
+        state_params.lambda_val = log["lambda_val"][0]
+        state_params.lambda_slope = log["lambda_slope"][0]
+        state_params.max_lambda = np.inf
+        if len(log["flip_time"]) > 1:
+            # invert update_lambda_by_params for the first frame
+            state_params.lambda_intercept = (
+                log["lambda_val"][1]
+                - log["lambda_slope"][0] * log["flip_time"][0] / 1000
+            )
+        return task_params, state_params
+
+    def compare(self, state_params, log, k):
+        for field in REPLAY_FIELDS:
+            logged = log[field][k]
+            replayed = getattr(state_params, field)
+            if logged.dtype == np.float32:
+                # compare at the precision it was logged with
+                replayed = np.float32(replayed)
+            if abs(float(logged) - float(replayed)) > self.tolerance:
+                return {
+                    "frame": int(k),
+                    "field": field,
+                    "logged": logged.item(),
+                    "replayed": float(replayed),
+                }
+        return None
+
+    def run(self):
+        log = read_session_log(self.events_path)
+        num_records = len(log["flip_time"])
+        task_params, state_params = self.initial_params(log)
+        result = {
+            "events_path": self.events_path,
+            "info_path": self.info_path,
+            "num_records": num_records,
+            "num_frames": 0,
+            "first_divergence": None,
+        }
+        if task_params.PHYSICS_HZ > 0:
+            result["error"] = "fixed-step physics sessions cannot be replayed"
+            return result
+        if num_records == 0:
+            return result
+
+        model = CST_Model()
+        model.set_parameters(task_params, state_params)
+        seeded = self.info_path is not None
+        rng = np.random.RandomState(task_params.RANDOM_SEED)
+
+        def reset_pos(k):
+            if seeded:
+                # same draw as ViewModel.initialize_stim/reset_stim
+                return 0.005 * (-1 if rng.randint(0, 2, 1) else 1)
+            return log["stim_pos"][k]
+
+        # with a stop record, the last row repeats the last frame's times
+        has_stop_record = num_records > 1 and (
+            log["flip_time"][-1] == log["flip_time"][-2]
+        )
+        num_frames = num_records - 1 if has_stop_record else num_records
+
+        state_params.stim_pos = reset_pos(0)
+        state_params.user_pos = 0.0
+        state_params.crash_count = 0
+        for k in range(num_frames):
+            state_params.user_pos = log["user_pos"][k]
+            if state_params.stim_to_center_dist > task_params.MAX_BOUNDS:
+                scale_val = task_params.SCALE_VALS[state_params.crash_count]
+                state_params.lambda_intercept -= scale_val * state_params.lambda_val
+                state_params.lambda_slope *= 0.95
+                state_params.crash_count += 1
+                state_params.did_crash = True
+                state_params.stim_pos = reset_pos(k)
+                state_params.user_pos = 0.0
+            state_params.flip_time = log["flip_time"][k]
+
+            divergence = self.compare(state_params, log, k)
+            result["num_frames"] = k + 1
+            if divergence is not None:
+                result["first_divergence"] = divergence
+                return result
+            state_params.did_crash = False
+            model.update_model()
+
+        if has_stop_record:
+            result["first_divergence"] = self.compare(
+                state_params, log, num_records - 1
+            )
+        return result
+
+
+def replay_file(events_path, tolerance=0.0):
+    return SessionReplay(events_path, tolerance=tolerance).run()
+
+
+def replay_files(paths, tolerance=0.0, jobs=1):
+    """Replay many sessions, in 'jobs' worker processes."""
+    args = [(p, tolerance) for p in paths]
+    if jobs <= 1:
+        return [replay_file(*a) for a in args]
+    with Pool(jobs) as pool:
+        return pool.starmap(replay_file, args, chunksize=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("events", nargs="+", help="_events CSVs or glob patterns")
+    parser.add_argument("--tolerance", type=float, default=0.0)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--out", default=None, help="Save all results as JSON")
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.events:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    results = replay_files(paths, args.tolerance, args.jobs)
+
+    num_diverged = 0
+    for res in results:
+        div = res["first_divergence"]
+        if "error" in res:
+            print(f"SKIP {res['events_path']}: {res['error']}")
+        elif div is None:
+            print(f"OK   {res['events_path']} ({res['num_frames']} frames)")
+        else:
+            num_diverged += 1
+            print(
+                f"DIFF {res['events_path']}: frame {div['frame']} {div['field']} "
+                f"logged {div['logged']!r}, replayed {div['replayed']!r}"
+            )
+    print(f"{len(results) - num_diverged} of {len(results)} sessions reproduced")
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if num_diverged > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
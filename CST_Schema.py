@@ -0,0 +1,175 @@
+import json
+import numbers
+
+import numpy as np
+
+from CST_Data_Structures import StateValues
+from CST_Supports import fields_getter
+
+
+def value_kind(default):
+    """Which values a field accepts, judged by its default value."""
+    if default is None:
+        return None
+    if isinstance(default, bool):
+        return "bool"
+    if isinstance(default, numbers.Real):
+        return "number"
+    if isinstance(default, str):
+        return "str"
+    if isinstance(default, (list, tuple, np.ndarray)):
+        return "sequence"
+    return None
+
+
+def is_kind(value, kind):
+    if kind is None:
+        return True
+    if kind == "bool":
+        return isinstance(value, (bool, np.bool_))
+    if kind == "number":
+        return isinstance(value, numbers.Real) and not isinstance(
+            value, (bool, np.bool_)
+        )
+    if kind == "str":
+        return isinstance(value, str)
+    return isinstance(value, (list, tuple, np.ndarray))
+
+
+class SlotRecord(object):
+    """
+    Base for the slotted records made by ParameterSchema. Has the same
+    interface as Parameters (as_dict, get_these_values, update_dict,
+    load_parameters, save_as_json, print_values), but a fixed set of
+    fields: setting a name that is not a field raises AttributeError,
+    and values loaded or updated from a dictionary are type-checked.
+    """
+
+    __slots__ = ()
+    schema = None
+
+    def __init__(self, init_file=None, values_dict=None):
+        for k, v in self.schema.defaults.items():
+            # copy mutable defaults, so records don't share them
+            setattr(self, k, list(v) if isinstance(v, list) else v)
+        if init_file is not None:
+            self.load_parameters(init_file)
+        if values_dict is not None:
+            self.update_dict(values_dict)
+
+    def as_dict(self):
+        """Return key/value pairs in a dictionary."""
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def as_str(self):
+        """Return key/value pairs in a formatted string"""
+        msl = max(len(k) for k in self.__slots__)
+        return "".join(f"{k:{msl}}:  {getattr(self, k)}\n" for k in self.__slots__)
+
+    def print_values(self):
+        """Print key/value pairs to stdio."""
+        print(f"\n{self.schema.name}:\n{self.as_str()}")
+
+    def get_these_values(self, get_list, as_list=True):
+        """Return the values of 'get_list', as a list or a dictionary."""
+        vals = list(self.schema.getter(get_list)(self))
+        if as_list is True:
+            return vals
+        return dict(zip(get_list, vals))
+
+    def update_dict(self, updated_dict):
+        self.schema.validate(updated_dict)
+        for k, v in updated_dict.items():
+            setattr(self, k, v)
+
+    def load_parameters(self, dict_path):
+        self.update_dict(self.schema.read_json(dict_path))
+
+    def save_as_json(self, file_path):
+        """Save the record to file_path."""
+        self.schema.write_json(self, file_path)
+
+
+class ParameterSchema(object):
+    """
+    Typed schema for one Parameters subclass.
+
+    The fields, their order and their types come from the defaults of
+    a freshly made instance of 'params_class' (plus any 'extra_fields'),
+    so the schema follows the class as parameters are added. From it:
+
+        record_class    : a SlotRecord subclass with one slot per field
+        validate(d)     : raise ValueError for unknown fields or values
+                          of the wrong type
+        read_json(path) : load and validate a JSON parameter file, as
+                          written by Parameters.save_as_json
+        write_json(params, path) : validate and save a Parameters object
+                          or record in the same layout
+        getter(fields)  : precompiled getter returning those values as a
+                          tuple, for per-frame extraction
+    """
+
+    def __init__(self, params_class, extra_fields=None):
+        self.name = params_class.__name__
+        self.defaults = params_class().as_dict()
+        if extra_fields is not None:
+            self.defaults.update(extra_fields)
+        self.fields = tuple(self.defaults)
+        self.kinds = {k: value_kind(v) for k, v in self.defaults.items()}
+        self.record_class = type(
+            f"{self.name}Record",
+            (SlotRecord,),
+            {"__slots__": self.fields, "schema": self},
+        )
+        self.__getters = {}
+
+    def new_record(self, params=None):
+        """A record with the default values, or those of 'params'."""
+        record = self.record_class()
+        if params is not None:
+            values = params.as_dict()
+            record.update_dict({k: values[k] for k in self.fields if k in values})
+        return record
+
+    def validate(self, values):
+        unknown = [k for k in values if k not in self.kinds]
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown {self.name} fields: {', '.join(unknown)}")
+        wrong = [
+            f"{k}={values[k]!r} (expected {self.kinds[k]})"
+            for k in values
+            if not is_kind(values[k], self.kinds[k])
+        ]
+        if len(wrong) > 0:
+            raise ValueError(f"Bad {self.name} values: {'; '.join(wrong)}")
+
+    def read_json(self, dict_path):
+        with open(dict_path, "r") as f:
+            values = json.load(f)
+        self.validate(values)
+        return values
+
+    def write_json(self, params, file_path):
+        values = params.as_dict()
+        self.validate(values)
+        with open(file_path, "w") as f:
+            json.dump(values, f)
+
+    def getter(self, fields):
+        """Cached fields_getter for 'fields'; all must be schema fields."""
+        fields = tuple(fields)
+        if fields not in self.__getters:
+            unknown = [k for k in fields if k not in self.kinds]
+            if len(unknown) > 0:
+                raise ValueError(
+                    f"Unknown {self.name} fields: {', '.join(unknown)}"
+                )
+            self.__getters[fields] = fields_getter(fields)
+        return self.__getters[fields]
+
+
+# the task's per-frame state (get_session_params, CST_Replay) is a
+# StateRecord: fixed slots, and the state init JSON is type-checked
+STATE_SCHEMA = ParameterSchema(StateValues)
+
+StateRecord = STATE_SCHEMA.record_class
@@ -0,0 +1,56 @@
+from CST_DataIO_pygaze import MoBI_Devices
+
+
+class CST_Session(object):
+    """
+    Window, input and MoBI devices shared by the phases of a session
+    (practice, calibration, CPT).
+
+    Made once and passed to each StateMachine(session=...): every phase
+    draws in the same window, reads the same connected input device and
+    streams to the same LSL outlets, EEG port and eyetracker, so going
+    from one phase to the next opens nothing new. The MoBI devices are
+    made by the first phase's set_parameters; close() shuts everything
+    down at the end of the session.
+
+    Inputs:
+        view_model   : object to use instead of a new ViewModel()
+                       (e.g. CST_Headless.HeadlessViewModel)
+        mobi_factory : callable taking mobi_dict and returning the MoBI
+                       devices object; default MoBI_Devices
+    """
+
+    def __init__(self, view_model=None, mobi_factory=MoBI_Devices):
+        if view_model is None:
+            # psychopy and pygaze only load for a real window
+            from CST_ViewModelPygaze import ViewModel
+
+            view_model = ViewModel()
+        self.view_model = view_model
+        self.mobi_factory = mobi_factory
+        self.mobi_dev = None
+
+    def mobi_devices(self, mobi_dict):
+        """The session's MoBI devices, made from 'mobi_dict' on first use."""
+        if self.mobi_dev is None:
+            self.mobi_dev = self.mobi_factory(mobi_dict)
+        return self.mobi_dev
+
+    def close_devices(self):
+        if self.mobi_dev is None:
+            return
+        # everything queued must reach the devices before they close
+        self.mobi_dev.close_dispatch()
+        self.mobi_dev.eyetracker.stop_recording()
+        self.mobi_dev.eyetracker.close()
+        self.mobi_dev.eeg.__del__()
+        self.mobi_dev = None
+
+    def close(self):
+        """Close the MoBI devices, the input device and the window."""
+        self.close_devices()
+        user_input = self.view_model.cst_user_input
+        if user_input is not None and user_input.shutdown is not None:
+            user_input.shutdown()
+        if self.view_model.disp is not None:
+            self.view_model.disp.close()
@@ -0,0 +1,420 @@
+import csv
+import json
+import os
+import threading
+import warnings
+from datetime import datetime
+
+import numpy as np
+
+from CST_Supports import fields_getter
+
+# logged_units entries that are not plain floats
+UNIT_DTYPES = {
+    "binary_state": np.bool_,
+    "integer_count": np.int64,
+}
+# column types in the columnar output formats: times and positions keep
+# float64 (CST_Replay feeds the positions back into the model), other
+# floats are stored as float32
+COLUMNAR_DTYPES = {
+    "binary_state": np.bool_,
+    "integer_count": np.int32,
+    "seconds": np.float64,
+    "arbitrary_distance": np.float64,
+}
+OUTPUT_EXTENSIONS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "hdf5": ".h5",
+}
+COLUMNAR_EXTENSIONS = [ext for fmt, ext in OUTPUT_EXTENSIONS.items() if fmt != "csv"]
+
+
+class LogBuffer(object):
+    """
+    Preallocated ring of per-frame logged values.
+
+    Backed by a NumPy structured array with one column per logged value.
+    The column dtype follows its unit ('binary_state' -> bool,
+    'integer_count' -> int64, everything else float64), and the units are
+    kept in the dtype metadata. Records are written into the array in
+    place, so memory stays flat however long or fast the task runs.
+
+    The frame loop calls capture() to pull the current values from a
+    Parameters object and commit() to store them. A reader (the
+    SessionLogWriter thread) drains the stored records with read().
+    If the reader falls more than 'capacity' records behind, the oldest
+    records are overwritten and counted in 'num_dropped'.
+
+    Inputs:
+        fields   : list of parameter names to log, in column order
+        units    : list of unit strings, one per field
+        capacity : number of records the ring holds
+    """
+
+    def __init__(self, fields, units, capacity):
+        self.fields = list(fields)
+        self.units = dict(zip(self.fields, units))
+        self.dtype = np.dtype(
+            [(f, UNIT_DTYPES.get(self.units[f], np.float64)) for f in self.fields],
+            metadata={"units": self.units},
+        )
+        self.capacity = int(capacity)
+        self.records = np.zeros(self.capacity, dtype=self.dtype)
+        self.__get_fields = fields_getter(self.fields)
+
+        self.num_written = 0
+        self.num_read = 0
+        self.num_dropped = 0
+
+    def capture(self, params):
+        """Return the current logged values of 'params' as a tuple."""
+        return self.__get_fields(params)
+
+    def commit(self, vals):
+        """Store one record in the next slot of the ring."""
+        self.records[self.num_written % self.capacity] = vals
+        self.num_written += 1
+
+    def column(self, name):
+        """Return the stored values of one field, oldest first."""
+        start = max(0, self.num_written - self.capacity)
+        idx = np.arange(start, self.num_written) % self.capacity
+        return self.records[name][idx]
+
+    def read(self, max_records):
+        """Return up to 'max_records' unread records as tuples, oldest first."""
+        return self.read_array(max_records).tolist()
+
+    def read_array(self, max_records):
+        """
+        Return up to 'max_records' unread records as a structured array
+        (a copy, in the buffer's dtype), oldest first.
+        """
+        behind = self.num_written - self.num_read
+        if behind > self.capacity:
+            lost = behind - self.capacity
+            self.num_dropped += lost
+            self.num_read += lost
+            warnings.warn(f"Log buffer overrun: {lost} records were dropped.")
+        count = max(0, min(self.num_written - self.num_read, max_records))
+        idx = np.arange(self.num_read, self.num_read + count) % self.capacity
+        chunk = self.records[idx]
+        self.num_read += count
+        return chunk
+
+
+class SessionLogWriter(object):
+    """
+    Streams records from a LogBuffer to disk on a background thread.
+
+    The writer thread wakes every 'flush_secs', drains the buffer in
+    chunks of at most 'chunk_size' records and appends them to the
+    '<out_path>.part' journal, flushing after every chunk. The frame
+    loop never touches the file. If the task dies mid-run, the .part
+    file is a readable CSV with every record written so far.
+
+    close() returns once the last records are drained; the output is
+    then finalized in 'output_format' on a background thread, so the
+    frame loop's thread never re-reads the journal (wait() blocks until
+    the file is written). For "csv" it
+    appends the 'datetime_ended' column to the journal and writes
+    'out_path', with the same layout as the old pandas.DataFrame.to_csv
+    output. For "parquet", "feather" or "hdf5" it writes a compressed,
+    typed columnar file next to it (see write_columnar) from the
+    records as drained, without going back through CSV text. The end
+    time, the units and any 'metadata' passed to close() are stored
+    once as file metadata. If the library for the format is missing,
+    the CSV is written instead, with a warning.
+
+    The columnar formats keep no .part journal unless 'journal' is
+    True: the records are held in memory until close(), and the file
+    writes and fsyncs are skipped.
+
+    Inputs:
+        out_path      : final CSV path
+        log_buffer    : LogBuffer to drain
+        chunk_size    : maximum records written per chunk
+        flush_secs    : longest time a record waits in the buffer
+        output_format : "csv", "parquet", "feather" or "hdf5"
+        journal       : write the .part CSV journal; default True only
+                        for "csv"
+    """
+
+    def __init__(
+        self,
+        out_path,
+        log_buffer,
+        chunk_size=256,
+        flush_secs=0.5,
+        output_format="csv",
+        journal=None,
+    ):
+        if output_format not in OUTPUT_EXTENSIONS:
+            raise ValueError(
+                f"Unknown output format {output_format!r}; "
+                f"expected one of {', '.join(OUTPUT_EXTENSIONS)}"
+            )
+        self.out_path = out_path
+        self.partial_path = f"{out_path}.part"
+        self.log_buffer = log_buffer
+        self.columns = list(log_buffer.fields)
+        self.chunk_size = chunk_size
+        self.flush_secs = flush_secs
+        self.output_format = output_format
+        self.journal = output_format == "csv" if journal is None else journal
+        self.records_written = 0
+        self.__chunks = []  # drained records, kept for the columnar file
+
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__datetime_ended = None
+        self.__metadata = None
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__run, name="SessionLogWriter", daemon=True
+        )
+        self.__thread.start()
+
+    def close(self, datetime_ended=None, metadata=None):
+        """
+        Write out remaining records and start finalizing the output
+        file. 'metadata' (a JSON-able dict) is stored in columnar files.
+        """
+        if datetime_ended is None:
+            now = datetime.now()  # current date and time
+            datetime_ended = now.strftime("%m/%d/%Y,%H:%M:%S")
+        self.__datetime_ended = datetime_ended
+        self.__metadata = metadata
+        self.__stop.set()
+        self.__thread.join()
+        # not a daemon: the interpreter waits for the file at exit
+        self.__thread = threading.Thread(
+            target=self.__finish, name="SessionLogFinalize"
+        )
+        self.__thread.start()
+
+    def wait(self):
+        """Block until close() has finished writing the output file."""
+        self.__thread.join()
+
+    def __drain(self, f, writer):
+        chunk = self.log_buffer.read_array(self.chunk_size)
+        while len(chunk) > 0:
+            if f is not None:
+                writer.writerows(chunk.tolist())
+                f.flush()
+                os.fsync(f.fileno())
+            if self.output_format != "csv":
+                self.__chunks.append(chunk)
+            self.records_written += len(chunk)
+            chunk = self.log_buffer.read_array(self.chunk_size)
+
+    def __run(self):
+        if self.journal:
+            with open(self.partial_path, "w", newline="") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(self.columns)
+                f.flush()
+                self.__write_chunks(f, writer)
+        else:
+            self.__write_chunks(None, None)
+
+    def __finish(self):
+        if self.output_format != "csv":
+            try:
+                self.__finalize_columnar()
+                return
+            except ModuleNotFoundError as err:
+                warnings.warn(
+                    f"Cannot write {self.output_format} ({err}); "
+                    "writing the session log as CSV instead."
+                )
+        self.__finalize()
+
+    def __write_chunks(self, f, writer):
+        while self.__stop.wait(self.flush_secs) is False:
+            self.__drain(f, writer)
+        self.__drain(f, writer)
+
+    def __records(self):
+        """The drained records of a columnar run, as one array."""
+        if len(self.__chunks) > 0:
+            return np.concatenate(self.__chunks)
+        return np.zeros(0, dtype=self.log_buffer.dtype)
+
+    def __finalize_columnar(self):
+        records = self.__records()
+        metadata = {
+            "datetime_ended": self.__datetime_ended,
+            "units": self.log_buffer.units,
+            "num_dropped": self.log_buffer.num_dropped,
+        }
+        if self.__metadata is not None:
+            metadata.update(self.__metadata)
+        stem, _ = os.path.splitext(self.out_path)
+        write_columnar(
+            f"{stem}{OUTPUT_EXTENSIONS[self.output_format]}",
+            self.output_format,
+            typed_columns(records, self.columns, self.log_buffer.units),
+            metadata,
+        )
+        self.__chunks = []
+        if self.journal:
+            os.remove(self.partial_path)
+
+    def __finalize(self):
+        if not self.journal:
+            # columnar run falling back to CSV: write the kept records
+            with open(self.out_path, "w", newline="") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(self.columns + ["datetime_ended"])
+                for row in self.__records().tolist():
+                    writer.writerow(row + (self.__datetime_ended,))
+            self.__chunks = []
+            return
+        ended = self.__datetime_ended
+        if "," in ended:
+            ended = f'"{ended}"'
+        with open(self.partial_path, "r", newline="") as src, open(
+            self.out_path, "w", newline=""
+        ) as dst:
+            header = src.readline().rstrip("\n")
+            dst.write(f"{header},datetime_ended\n")
+            for line in src:
+                line = line.rstrip("\n")
+                dst.write(f"{line},{ended}\n")
+        os.remove(self.partial_path)
+
+
+def read_session_log(file_path):
+    """
+    Read an _events CSV (final or .part) into a dict of NumPy columns.
+    "True"/"False" columns become bool, numeric columns float64, and
+    anything else (datetime_ended) stays as strings. Parquet, Feather
+    and HDF5 session logs are read with read_columnar().
+    """
+    file_path = str(file_path)
+    if os.path.splitext(file_path)[1] in COLUMNAR_EXTENSIONS:
+        return read_columnar(file_path)[0]
+    with open(file_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if len(row) == len(header)]
+
+    columns = {}
+    for name, values in zip(header, zip(*rows) if rows else [()] * len(header)):
+        if len(values) > 0 and set(values) <= {"True", "False"}:
+            columns[name] = np.array(values) == "True"
+            continue
+        try:
+            columns[name] = np.array(values, dtype=np.float64)
+        except ValueError:
+            columns[name] = np.array(values)
+    return columns
+
+
+def typed_columns(log, fields, units):
+    """
+    Cast the columns of 'log' (a LogBuffer structured array, or a
+    read_session_log dict) to the columnar output types.
+    """
+    return {
+        f: np.asarray(log[f]).astype(COLUMNAR_DTYPES.get(units[f], np.float32))
+        for f in fields
+    }
+
+
+def write_columnar(file_path, output_format, columns, metadata):
+    """
+    Write 'columns' (name -> 1-D array) compressed to a Parquet, Feather
+    or HDF5 file, with 'metadata' stored as JSON under the key
+    "cst_metadata": in the Arrow schema metadata for Parquet and
+    Feather, and as an attribute of the root group for HDF5 (one
+    dataset per column). Raises ModuleNotFoundError if pyarrow (or h5py)
+    is not installed.
+    """
+    meta_json = json.dumps(metadata, default=json_default)
+    if output_format == "hdf5":
+        import h5py
+
+        with h5py.File(file_path, "w") as f:
+            f.attrs["cst_metadata"] = meta_json
+            f.attrs["columns"] = json.dumps(list(columns))
+            for name, values in columns.items():
+                f.create_dataset(
+                    name, data=values, compression="gzip", shuffle=True
+                )
+        return
+
+    import pyarrow as pa
+
+    table = pa.table(columns).replace_schema_metadata({"cst_metadata": meta_json})
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, file_path, compression="zstd")
+    else:
+        import pyarrow.feather as feather
+
+        feather.write_feather(table, file_path, compression="zstd")
+
+
+def read_columnar(file_path):
+    """Read a file made by write_columnar: (columns, metadata)."""
+    if file_path.endswith(OUTPUT_EXTENSIONS["hdf5"]):
+        import h5py
+
+        with h5py.File(file_path, "r") as f:
+            names = json.loads(f.attrs["columns"])
+            columns = {name: f[name][()] for name in names}
+            return columns, json.loads(f.attrs["cst_metadata"])
+
+    if file_path.endswith(OUTPUT_EXTENSIONS["parquet"]):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(file_path)
+    else:
+        import pyarrow.feather as feather
+
+        table = feather.read_table(file_path)
+    columns = {name: table[name].to_numpy() for name in table.column_names}
+    return columns, json.loads(table.schema.metadata[b"cst_metadata"])
+
+
+def export_csv(file_path, csv_path=None):
+    """
+    Export a columnar session log to CSV in the task's usual layout,
+    with the datetime_ended column restored from the metadata.
+    """
+    columns, metadata = read_columnar(file_path)
+    if csv_path is None:
+        csv_path = f"{os.path.splitext(file_path)[0]}.csv"
+    ended = metadata.get("datetime_ended", "")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(list(columns) + ["datetime_ended"])
+        for row in zip(*[values.tolist() for values in columns.values()]):
+            writer.writerow(row + (ended,))
+    return csv_path
+
+
+def json_default(value):
+    """JSON fallback for NumPy values in session metadata."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("usage: python CST_SessionLog.py SESSION_LOG [SESSION_LOG ...]")
+        print("Exports Parquet/Feather/HDF5 session logs to CSV.")
+        sys.exit(1)
+    for file_path in sys.argv[1:]:
+        print(f"saved {export_csv(file_path)}")
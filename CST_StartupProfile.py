@@ -0,0 +1,64 @@
+"""
+Per-phase timing of task startup (imports, window, devices).
+
+Imports nothing heavy itself, so it can be imported first and time the
+imports that follow:
+
+    profile = StartupProfile()
+    with profile.phase("import psychopy"):
+        from psychopy import core
+    ...
+    profile.report()
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile(object):
+    """
+    Wall time of named startup phases, in the order they ran.
+
+    Inputs:
+        started_at : perf_counter time the process started its work;
+                     default is now
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        num_modules = len(sys.modules)
+        began_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                {
+                    "phase": name,
+                    "secs": time.perf_counter() - began_at,
+                    "new_modules": len(sys.modules) - num_modules,
+                }
+            )
+
+    def total_secs(self):
+        return time.perf_counter() - self.started_at
+
+    def report(self, file_path=None):
+        """Print the phases; also save them as JSON to 'file_path'."""
+        width = max([len(p["phase"]) for p in self.phases] + [5])
+        print(f"\n{'phase':{width}}  {'ms':>9}  modules")
+        for p in self.phases:
+            print(
+                f"{p['phase']:{width}}  {p['secs'] * 1000:9.1f}  "
+                f"{p['new_modules']:7d}"
+            )
+        total = self.total_secs()
+        print(f"{'total':{width}}  {total * 1000:9.1f}  {len(sys.modules):7d}\n")
+        if file_path is not None:
+            with open(file_path, "w") as f:
+                json.dump({"phases": self.phases, "total_secs": total}, f, indent=2)
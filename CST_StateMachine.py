@@ -1,10 +1,11 @@
 from datetime import datetime
 import numpy as np
-import pandas as pd
-from psychopy import core
-from CST_Calculations import CST_Model
-from CST_ViewModelPygaze import ViewModel
+from CST_Calculations import CST_Model, FixedStepPhysics, OnsetSchedule
 from CST_DataIO_pygaze import MoBI_Devices
+from CST_FrameTiming import INPUT, LOG, LOGIC, MOBI, MODEL, FrameTimer
+from CST_Replay import replay_info_path, write_replay_info
+from CST_Session import CST_Session
+from CST_SessionLog import LogBuffer, SessionLogWriter
 
 
 class StateMachine(object):
@@ -20,16 +21,48 @@ class StateMachine(object):
     IO is through the abstracted CST_DataIO
     class. Maybe a bit much, but I wanted to make it as
     flexible as possible.
+
+    Optional kwargs:
+        session      : CST_Session whose window and devices to use; they
+                       stay open after the run for the next phase
+    Without a session, the StateMachine makes its own and closes its
+    MoBI devices when the run ends. For that one (e.g. for headless
+    runs, see CST_Headless):
+        view_model   : object to use instead of a new ViewModel()
+        mobi_factory : callable taking mobi_dict and returning the
+                       MoBI devices object; default MoBI_Devices
+    Either way:
+        clock        : run clock with getTime() and reset(); default a
+                       psychopy core.Clock (CST_Headless.HeadlessClock
+                       runs without psychopy)
     """
 
     def __init__(self, **kwargs):
-        self.view_model = ViewModel()
+        session = kwargs.get("session", None)
+        self.owns_session = session is None
+        if session is None:
+            session = CST_Session(
+                kwargs.get("view_model", None),
+                kwargs.get("mobi_factory", MoBI_Devices),
+            )
+        self.session = session
+        self.view_model = session.view_model
         self.cst_model = CST_Model()
-        self.exp_timer = core.Clock()
+        self.exp_timer = kwargs.get("clock", None)
+        if self.exp_timer is None:
+            from psychopy import core
+
+            self.exp_timer = core.Clock()
         self.mobi_dev = None
         self.lambda_c_vals = []
+        self.crash_times = []  # flip_time of the last frame before each crash
 
-        self.log_data = []
+        self.log_buffer = None
+        self.log_writer = None
+        self.frame_timer = None
+        self.schedule = None
+        self.physics = None
+        self.run_seed = None  # seed of the reset directions this run
         self.logged_values = [
             "expected_time",
             "flip_time",
@@ -40,6 +73,8 @@ class StateMachine(object):
             "change_rate_x",
             "did_crash",
             "lambda_slope",
+            "flip_error",
+            "user_pos_raw",
         ]
         self.logged_units = [
             "seconds",
@@ -51,6 +86,8 @@ class StateMachine(object):
             "units_per_second",
             "binary_state",
             "units_per_second",
+            "seconds",
+            "arbitrary_distance",
         ]
 
         self.params_are_set = False
@@ -60,6 +97,18 @@ class StateMachine(object):
         self.state_params = state_params
         self.view_model.set_parameters(self.task_params, self.state_params)
         self.cst_model.set_parameters(self.task_params, self.state_params)
+        if self.task_params.PHYSICS_HZ > 0:
+            # model + input on their own fixed clock; the view interpolates
+            self.physics = FixedStepPhysics(
+                self.cst_model,
+                self.view_model.cst_user_input.get_xy_position,
+                physics_hz=self.task_params.PHYSICS_HZ,
+                reference_hz=self.task_params.PHYSICS_REFERENCE_HZ,
+                max_bounds=self.task_params.MAX_BOUNDS,
+            )
+        else:
+            self.physics = None
+        self.view_model.physics = self.physics
         ## MoBI LSL
         # Update mobi_dict with runtime info
         mobi_dict["display"] = self.view_model.disp
@@ -69,7 +118,13 @@ class StateMachine(object):
 
         mobi_dict["channel_info"] = dict(zip(self.logged_values, self.logged_units))
 
-        self.mobi_dev = MoBI_Devices(mobi_dict)
+        self.mobi_dev = self.session.mobi_devices(mobi_dict)
+
+        self.log_buffer = LogBuffer(
+            self.logged_values, self.logged_units, self.max_log_records()
+        )
+        self.frame_timer = FrameTimer(self.max_log_records())
+        self.view_model.frame_timer = self.frame_timer
 
         self.state_params.crash_count = 0
 
@@ -78,10 +133,44 @@ class StateMachine(object):
     def show_instructions(self, message_str=None):
         self.view_model.show_instructions(message_str=message_str)
 
+    def max_log_records(self):
+        """
+        One record per onset, but a run never outlasts MAX_SECONDS, so
+        cap it there; plus one for the extra record written at stop.
+        """
+        max_frames = int(
+            self.task_params.MAX_SECONDS / self.task_params.TASK_LOOP_RATE
+        )
+        return min(len(self.task_params.ONSETS), max_frames + 2) + 1
+
     def update_log(self):
-        vals = self.state_params.get_these_values(self.logged_values)
+        vals = self.log_buffer.capture(self.state_params)
         self.state_params.did_crash = False
-        self.log_data.append(vals)
+        self.log_buffer.commit(vals)
+
+    def start_log(self):
+        outname = f"{self.task_params.OUTPUT_STEM}.csv"
+        self.log_writer = SessionLogWriter(
+            outname, self.log_buffer, output_format=self.task_params.OUTPUT_FORMAT
+        )
+        self.log_writer.start()
+
+    def seed_run(self):
+        """
+        Seed the reset directions for this run and save what CST_Replay
+        needs to reproduce it.
+        """
+        # drawn per run, not into task_params: phases share those
+        self.run_seed = self.task_params.RANDOM_SEED
+        if self.run_seed is None:
+            self.run_seed = int(np.random.randint(2**31))
+        self.view_model.rng = np.random.RandomState(self.run_seed)
+        write_replay_info(
+            replay_info_path(self.task_params.OUTPUT_STEM),
+            self.task_params,
+            self.state_params,
+            seed=self.run_seed,
+        )
 
     def write_log(self):
         x = self.task_params.OUTPUT_STEM
@@ -90,49 +179,128 @@ class StateMachine(object):
             x[3] = "MAIN"
         else:
             x[3] == "CALIB"
-        outname = f"{self.task_params.OUTPUT_STEM}.csv"
-        df = pd.DataFrame(columns=self.logged_values, data=self.log_data)
         now = datetime.now()  # current date and time
         date_time = now.strftime("%m/%d/%Y,%H:%M:%S")
-        df["datetime_ended"] = date_time
-        df.to_csv(outname, index=False)
+        task_params = self.task_params.as_dict()
+        # the onsets are recomputable and can be millions of values
+        task_params["ONSETS"] = f"{len(self.task_params.ONSETS)} onsets"
+        metadata = {
+            "task_params": task_params,
+            "session": {
+                "mode": self.task_params.TASK_MODE,
+                "output_stem": self.task_params.OUTPUT_STEM,
+                "num_crashes": self.state_params.crash_count,
+            },
+        }
+        self.log_writer.close(datetime_ended=date_time, metadata=metadata)
+
+    def write_frame_timing(self):
+        """Phase timing summary, next to the _events output."""
+        stem = self.task_params.OUTPUT_STEM
+        if stem.endswith("_events"):
+            stem = stem[: -len("_events")]
+        late_threshold = self.task_params.LATE_FLIP_SECS
+        if late_threshold is None:
+            late_threshold = self.task_params.TASK_LOOP_RATE / 2
+        summary = self.frame_timer.write_summary(
+            f"{stem}_frametiming.json",
+            late_threshold,
+            extra={
+                "mobi_dispatch": self.mobi_dev.dispatch_report(),
+                "schedule": self.schedule.report(),
+                "flip_scheduler": self.view_model.flip_scheduler.report(),
+            },
+        )
+        print(
+            f"Frame timing: {summary['num_late_frames']} of "
+            f"{summary['num_frames']} flips later than {late_threshold * 1000:.1f} ms"
+        )
 
     def write_out_lambdas(self):
         now = datetime.now()  # current date and time
         date_time = now.strftime("%m/%d/%Y,%H:%M:%S")
         lambda_c_vals = np.array(self.lambda_c_vals)
         lambda_c_str = ",".join(lambda_c_vals.astype(str))
+        # legacy line layout (task-, run-, ...); the visit is only in the DB
         params = self.task_params.OUTPUT_STEM.split("_")[2:]
         params_str = ",".join(params)
         save_str = f"{self.task_params.subid},{params_str},{date_time},{lambda_c_str}\n"
         with open("calibration_lambdas.csv", "a") as f:
             f.writelines(save_str)
 
+        if self.task_params.CALIBRATION_DB is not None:
+            from CST_CalibrationDB import CalibrationDB
+
+            with CalibrationDB(self.task_params.CALIBRATION_DB) as db:
+                db.add_run(
+                    self.task_params.subid,
+                    getattr(self.task_params, "visit", None),
+                    getattr(self.task_params, "run", None),
+                    self.lambda_c_vals,
+                    self.crash_times,
+                    datetime_ended=now.isoformat(timespec="seconds"),
+                )
+
+    def mobi_send_marker(self, marker, at_time):
+        self.mobi_dev.send(
+            "marker_outlet", "push_sample", [marker], self.mobi_dev.lsl_time(at_time)
+        )
+
     def mobi_send_started(self):
-        self.mobi_dev.slt.pushToStreamLabel(f"Onset {self.task_params.TASK_MODE}")
-        self.mobi_dev.eeg.setData(255)
-        self.mobi_dev.eyetracker.log(f"Onset {self.task_params.TASK_MODE}")
-        self.mobi_dev.eyetracker.status_msg(f"Running:{self.task_params.TASK_MODE}")
+        mode = self.task_params.TASK_MODE
+        self.mobi_dev.map_clock(self.exp_timer)
+        self.mobi_send_marker(f"Onset {mode}", self.exp_timer.getTime())
+        self.mobi_dev.send("slt", "pushToStreamLabel", f"Onset {mode}")
+        self.mobi_dev.send("eeg", "setData", 255)
+        self.mobi_dev.send("eyetracker", "log", f"Onset {mode}")
+        self.mobi_dev.send("eyetracker", "status_msg", f"Running:{mode}")
 
     def mobi_send_crashed(self, at_time, vals):
-        self.mobi_dev.slt.pushToStreamLabel(f"Crashed {vals}")
-        self.mobi_dev.eeg.setData(128)
-        self.mobi_dev.lsl_outlet.push_sample(vals)
-        self.mobi_dev.eyetracker.log(f"Crashed:{at_time}")
-        self.mobi_dev.eyetracker.status_msg(f"Crashed:{at_time}")
+        self.mobi_send_marker("Crashed", at_time)
+        self.mobi_dev.send("slt", "pushToStreamLabel", f"Crashed {vals}")
+        self.mobi_dev.send("eeg", "setData", 128)
+        self.mobi_dev.send(
+            "lsl_chunker", "push", vals, self.mobi_dev.lsl_time(at_time)
+        )
+        # the crash pause would hold the buffered samples back
+        self.mobi_dev.send("lsl_chunker", "flush")
+        self.mobi_dev.send("eyetracker", "log", f"Crashed:{at_time}")
+        self.mobi_dev.send("eyetracker", "status_msg", f"Crashed:{at_time}")
 
     def mobi_close_devices(self):
-        self.mobi_dev.slt.pushToStreamLabel(f"TaskEnded {self.task_params.TASK_MODE}")
-        self.mobi_dev.eeg.setData(255)
-        self.mobi_dev.eyetracker.log(f"TaskEnded {self.task_params.TASK_MODE}")
-        self.mobi_dev.eyetracker.status_msg(f"Closing:{self.task_params.TASK_MODE}")
-        self.mobi_dev.eyetracker.stop_recording()
-        self.mobi_dev.eyetracker.close()
-        self.mobi_dev.eeg.__del__()
-
-    def mobi_update_vals(self, vals):
-        self.mobi_dev.lsl_outlet.push_sample(vals)
-        self.mobi_dev.eeg.setData(0)
+        mode = self.task_params.TASK_MODE
+        self.mobi_send_marker(f"TaskEnded {mode}", self.state_params.flip_time)
+        self.mobi_dev.send("lsl_chunker", "flush")
+        self.mobi_dev.send("slt", "pushToStreamLabel", f"TaskEnded {mode}")
+        self.mobi_dev.send("eeg", "setData", 255)
+        self.mobi_dev.send("eyetracker", "log", f"TaskEnded {mode}")
+        self.mobi_dev.send("eyetracker", "status_msg", f"Closing:{mode}")
+        # everything queued must reach the devices before the run ends
+        self.mobi_dev.drain_dispatch()
+        if self.owns_session:
+            self.session.close_devices()
+
+    def mobi_update_vals(self, vals, flip_time):
+        self.mobi_dev.send(
+            "lsl_chunker", "push", vals, self.mobi_dev.lsl_time(flip_time)
+        )
+        self.mobi_dev.send("eeg", "setData", 0)
+
+    def raw_user_pos(self):
+        """x as read from the device, before any INPUT_FILTER."""
+        input_filter = self.view_model.cst_user_input.input_filter
+        if input_filter is None:
+            return self.state_params.user_pos
+        return input_filter.raw_x
+
+    def input_flipped(self):
+        input_filter = self.view_model.cst_user_input.input_filter
+        if input_filter is not None:
+            # read-to-flip latency for the prediction
+            input_filter.flipped()
+        if self.physics is not None:
+            # the physics steps read the input during the frame
+            self.state_params.user_pos_raw = self.raw_user_pos()
 
     def run(self):
         if self.params_are_set is True:
@@ -149,15 +317,30 @@ class StateMachine(object):
 
             # use window flip in view_model to synch
             # onset timing to VBL
+            self.start_log()
+            # fresh schedule per run; crash pauses shift it, not ONSETS
+            self.schedule = OnsetSchedule(self.task_params.ONSETS)
+            self.view_model.schedule = self.schedule
+            self.seed_run()
             self.view_model.initialize_stim()
             self.exp_timer.reset()
+            # frames are stamped with the last flip; none yet on this clock
+            self.state_params.flip_time = 0.0
+            self.state_params.flip_error = 0.0
+            if self.physics is not None:
+                # like update_model, no steps before the first onset
+                self.physics.reset(self.task_params.ONSETS[0])
             self.mobi_send_started()
-            for t in self.task_params.ONSETS:
+            for t in self.schedule:
+                self.frame_timer.start_frame()
                 self.state_params.current_trial = trial_num
-                (
-                    self.state_params.user_pos,
-                    _,
-                ) = self.view_model.cst_user_input.get_xy_position()
+                if self.physics is None:
+                    (
+                        self.state_params.user_pos,
+                        _,
+                    ) = self.view_model.cst_user_input.get_xy_position()
+                    self.state_params.user_pos_raw = self.raw_user_pos()
+                self.frame_timer.mark(INPUT)
 
                 if self.state_params.stim_to_center_dist > self.task_params.MAX_BOUNDS:
                     self.state_params.is_OOB = True
@@ -165,9 +348,10 @@ class StateMachine(object):
                     # pulling list of values from params object and sending to mobi_send_crashed
                     self.mobi_send_crashed(
                         at_time=self.state_params.flip_time,
-                        vals=self.state_params.get_these_values(self.logged_values),
+                        vals=self.log_buffer.capture(self.state_params),
                     )
                     self.lambda_c_vals.append(self.state_params.lambda_val)
+                    self.crash_times.append(self.state_params.flip_time)
                     scale_val = self.task_params.SCALE_VALS[
                         self.state_params.crash_count
                     ]
@@ -182,8 +366,10 @@ class StateMachine(object):
                     ## MoBI Devices
                     # pulling list of values from params object and sending to mobi_update
                     self.mobi_update_vals(
-                        self.state_params.get_these_values(self.logged_values)
+                        self.log_buffer.capture(self.state_params),
+                        self.state_params.flip_time,
                     )
+                self.frame_timer.mark(MOBI)
                 if np.logical_and(
                     self.state_params.crash_count >= self.task_params.NUM_TEST_TRIALS,
                     self.task_params.TASK_MODE == "CALIBRATE",
@@ -191,13 +377,18 @@ class StateMachine(object):
                     self.state_params.stop_run = True
 
                 self.state_params.expected_time = t
-                flip_time = self.view_model.update_and_flip_at(
-                    self.exp_timer, t - 0.005
-                )
+                self.frame_timer.mark(LOGIC)
+                flip_time = self.view_model.update_and_flip_at(self.exp_timer, t)
                 self.state_params.flip_time = flip_time
+                self.state_params.flip_error = flip_time - self.view_model.flip_target
+                self.input_flipped()
 
                 self.update_log()
-                self.cst_model.update_model()
+                self.frame_timer.mark(LOG)
+                if self.physics is None:
+                    self.cst_model.update_model()
+                self.frame_timer.mark(MODEL)
+                self.frame_timer.end_frame(self.view_model.flip_target, flip_time)
 
                 if self.state_params.flip_time >= self.task_params.MAX_SECONDS:
                     self.state_params.stop_run = True
@@ -206,6 +397,7 @@ class StateMachine(object):
                     self.update_log()
                     self.write_log()
                     self.mobi_close_devices()
+                    self.write_frame_timing()
                     if self.task_params.TASK_MODE == "CALIBRATE":
                         self.write_out_lambdas()
                     self.view_model.show_instructions("Great Job!")
@@ -1,7 +1,20 @@
 import json
+from operator import attrgetter
 from pathlib import Path
 
 
+def fields_getter(fields):
+    """
+    Precompiled getter for a fixed field list: one C-level call that
+    returns the values of 'fields' of an object as a tuple.
+    """
+    fields = tuple(fields)
+    if len(fields) == 1:
+        get_one = attrgetter(fields[0])
+        return lambda obj: (get_one(obj),)
+    return attrgetter(*fields)
+
+
 class Parameters(object):
     """
     Container class for passing/tracking parameters.
@@ -15,6 +28,9 @@ class Parameters(object):
     ----------
     get_these_values(): accepts a list of variables, and returns the values
                         of these variables as a list, or as a dictonary
+    getter(): accepts a list of variables, and returns a function that
+                        gets their values from a Parameters object as a
+                        tuple; for values read every frame
     as_dict(): returns all parameter key/value pairs in dictionary
     as_str(): returns all parameter key/value pairs in formatted string
     print_values(): prints all parameter key/value pairs to screen
@@ -56,6 +72,17 @@ class Parameters(object):
         else:
             return dict(zip(get_list, L))
 
+    def getter(self, get_list):
+        """
+        Return a function that gets the values in 'get_list' from a
+        Parameters object like this one, as a tuple. Unlike
+        get_these_values(), every name must exist.
+        """
+        missing = [k for k in get_list if k not in self.__dict__]
+        if len(missing) > 0:
+            raise ValueError(f"No such parameters: {', '.join(missing)}")
+        return fields_getter(get_list)
+
     def as_dict(self):
         """Return key/value pairs in a dictionary."""
         d = {k: self.__dict__[k] for k in self.__dict__.keys() if "__" not in k}
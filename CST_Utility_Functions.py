@@ -6,12 +6,8 @@ from pathlib import Path
 import numpy as np
 
 from CST_Calculations import compute_timeseries
-from CST_Data_Structures import StateValues, TaskParameters
-
-try:
-    import serial
-except:
-    print("serial not found. Accelerometry will not be available.")
+from CST_Data_Structures import TaskParameters
+from CST_Schema import StateRecord
 
 
 class cst_parser(object):
@@ -44,7 +40,7 @@ class cst_parser(object):
             dest="XY_INPUT_MODE",
             required=False,
             default="ACCEL",
-            help="How are we getting X position; default='ACCEL'; options MOUSE",
+            help="How are we getting X position; default='ACCEL'; options MOUSE, ACCEL_STREAM, ACCEL_BINARY",
         )
         self.parser.add_argument(
             "--lambda_init_value",
@@ -78,6 +74,32 @@ class cst_parser(object):
             default=30,
             help="Rate in Hz at which to refresh the task. Defaut=30",
         )
+        self.parser.add_argument(
+            "--refresh_measure_frames",
+            dest="REFRESH_MEASURE_FRAMES",
+            required=False,
+            type=int,
+            default=60,
+            help="Flips used to measure the refresh period at startup; "
+            "0 = don't snap flips to the refresh. Default=60",
+        )
+        self.parser.add_argument(
+            "--physics_hz",
+            dest="PHYSICS_HZ",
+            required=False,
+            type=float,
+            default=0,
+            help="Fixed model/input rate in Hz, independent of the display; "
+            "0 = once per refresh. Default=0",
+        )
+        self.parser.add_argument(
+            "--input_filter",
+            dest="INPUT_FILTER",
+            required=False,
+            choices=["kalman", "one_euro"],
+            default=None,
+            help="Filter the xy input and predict it to the flip. Default=off",
+        )
         self.parser.add_argument(
             "--reverse_x",
             dest="REVERSE_COORDS",
@@ -85,6 +107,23 @@ class cst_parser(object):
             help="Reverse standard CST mapping.",
         )
         self.parser.set_defaults(REVERSE_COORDS=False)
+        self.parser.add_argument(
+            "--output_format",
+            dest="OUTPUT_FORMAT",
+            required=False,
+            choices=["csv", "parquet", "feather", "hdf5"],
+            default="csv",
+            help="Session log format. Parquet/Feather need pyarrow, HDF5 "
+            "needs h5py; these keep no .part crash journal. Default=csv",
+        )
+        self.parser.add_argument(
+            "--retained_rendering",
+            dest="RETAINED_RENDERING",
+            action="store_true",
+            help="Pre-render the static background once and redraw only "
+            "the stimuli and text each frame.",
+        )
+        self.parser.set_defaults(RETAINED_RENDERING=False)
         self.parser.add_argument(
             "--show_score",
             dest="SHOW_SCORE",
@@ -107,6 +146,38 @@ class cst_parser(object):
             help="Send Tracking? default=False.",
         )
         self.parser.set_defaults(withEyetracker=False)
+
+        self.parser.add_argument(
+            "--mobi_async",
+            dest="mobi_async",
+            action="store_true",
+            help="Send LSL/eyetracker calls from a worker thread. Default=False.",
+        )
+        self.parser.set_defaults(mobi_async=False)
+
+        self.parser.add_argument(
+            "--profile_startup",
+            dest="profile_startup",
+            action="store_true",
+            help="Report import and window/device setup times, then exit.",
+        )
+        self.parser.set_defaults(profile_startup=False)
+
+        self.parser.add_argument(
+            "--lsl_chunk_samples",
+            dest="lsl_chunk_samples",
+            type=int,
+            default=1,
+            help="Task values sent to LSL in chunks of this many samples. Default=1",
+        )
+
+        self.parser.add_argument(
+            "--lsl_chunk_ms",
+            dest="lsl_chunk_ms",
+            type=float,
+            default=0,
+            help="Longest a sample waits for its LSL chunk, in ms. Default=0 (off)",
+        )
         
         self.parser.add_argument(
             "--visit",
@@ -173,11 +244,70 @@ class SerialConstants2(object):
         self.set_oversample_5 = str.encode(":106,5\n")
         self.set_oversample_10 = str.encode(":106,10\n")
 
+        # streaming: slot 1 = tared euler (cmd 1), remaining slots empty
+        self.set_stream_slots_tared_euler = str.encode(
+            ":80,1,255,255,255,255,255,255,255\n"
+        )
+        self.start_streaming = str.encode(";85\n")
+        self.stop_streaming = str.encode(":86\n")
+
+        # binary response layouts (big-endian) for the argument-free
+        # commands above, keyed on command number; without header.
+        self.binary_response_formats = {
+            0: ">4f",  # tared quaternion
+            1: ">3f",  # tared euler
+            2: ">9f",  # tared rotation matrix
+            3: ">4f",  # tared axis-angle
+            4: ">6f",  # tared two vector
+            5: ">4f",  # difference quaternion
+            32: ">9f",  # normalized gyro, accel, compass
+            33: ">3f",  # normalized gyro
+            34: ">3f",  # normalized accel
+            38: ">3f",  # corrected gyro
+            39: ">3f",  # corrected accel
+            250: ">B",  # button state
+        }
+        # header added to ';' commands by include_timestamp (:221,2)
+        self.binary_header_format = ">I"
+
+    def as_binary(self, ascii_cmd):
+        """
+        Translate an argument-free ASCII command from this table into
+        its binary packet: start byte (0xF7, or 0xF9 for ';' commands
+        with response header), command byte, checksum.
+        Returns (packet, response_format).
+        """
+        text = ascii_cmd.decode().strip()
+        if text[0] not in ":;" or "," in text:
+            raise ValueError(
+                f"No binary form for {ascii_cmd}; only argument-free wired commands"
+            )
+        cmd = int(text[1:])
+        fmt = self.binary_response_formats[cmd]
+        if text[0] == ";":
+            start = 0xF9
+            fmt = self.binary_header_format + fmt[1:]
+        else:
+            start = 0xF7
+        return bytes((start, cmd, cmd % 256)), fmt
+
+    def stream_timing(self, interval_us, duration_us=0xFFFFFFFF, delay_us=0):
+        """Streaming interval/duration/delay command; default runs until stopped."""
+        return str.encode(
+            f":82,{int(interval_us)},{int(duration_us)},{int(delay_us)}\n"
+        )
+
 
 def get_session_params(command_line_args, task_init_path=None, state_init_path=None):
 
     d = {arg: getattr(command_line_args, arg) for arg in vars(command_line_args)}
     d["XY_INPUT_MODE"] = d["XY_INPUT_MODE"].upper()
+    if d["PHYSICS_HZ"] > 0 and d["XY_INPUT_MODE"] in ("ACCEL", "ACCEL_BINARY"):
+        # each physics step reads the input: a blocking serial round trip
+        raise ValueError(
+            f"--physics_hz needs a non-blocking input; use ACCEL_STREAM "
+            f"instead of {d['XY_INPUT_MODE']}."
+        )
     now = datetime.now()  # current date and time
     date_time = now.strftime("%m-%d-%Y_%H-%M")
     cal_output_stem = f"/home/nkirs/Desktop/MOBI/Output/sub-{d['subid']}/ses-{d['visit']}/raw/sub-{d['subid']}_ses-{d['visit']}_task-CPTCalibrate_run-{d['run']}_events"
@@ -185,9 +315,9 @@ def get_session_params(command_line_args, task_init_path=None, state_init_path=N
     cal_task_params = TaskParameters(task_init_path, d)
     cal_task_params.MAX_SECONDS = 600
 
-    cal_state_params = StateValues(state_init_path)
+    cal_state_params = StateRecord(state_init_path)
     cpt_task_params = TaskParameters(task_init_path, d)
-    cpt_state_params = StateValues(state_init_path)
+    cpt_state_params = StateRecord(state_init_path)
 
     # set beginning lambda to the passed init value
     cpt_state_params.lambda_slope = cpt_task_params.LAMBDA_SLOPE_INIT
@@ -207,6 +337,10 @@ def get_session_params(command_line_args, task_init_path=None, state_init_path=N
     mobi_dict["sample_hz"] = d["loop_hz"]
     mobi_dict["UID"] = d["subid"]
     mobi_dict["display"] = None  # need to add at runtime
+    mobi_dict["dispatch_mode"] = "async" if d["mobi_async"] else "sync"
+    mobi_dict["sync_devices"] = ["eeg"]  # TTL triggers stay synchronous
+    mobi_dict["lsl_chunk_samples"] = d["lsl_chunk_samples"]
+    mobi_dict["lsl_chunk_ms"] = d["lsl_chunk_ms"]
 
     params_dict = {}
 
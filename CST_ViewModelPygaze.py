@@ -1,7 +1,15 @@
 import numpy as np
-import serial
-from psychopy import core, event
+from psychopy import core, event, visual
 from CST_DataIO_pygaze import CST_User_Input
+from CST_FrameTiming import (
+    DRAW,
+    FLIP,
+    PAUSE,
+    PHYSICS,
+    WAIT,
+    FlipScheduler,
+    FrameTimer,
+)
 from CST_Utility_Functions import SerialConstants2
 from CST_ViewPygaze import View
 from pygaze.libscreen import Display, Screen
@@ -16,6 +24,8 @@ class ViewModel(object):
         self.task_params = None
         self.state_params = None
         self.clock = core.Clock()
+        # drift direction after resets; seeded per run by the StateMachine
+        self.rng = np.random.RandomState()
         self.stim_default_color = [-0.25, -0.25, 0.75]
         self.stim_highlight_color = [0.2, 1.0, 0.2]
         self.outer_stim_default_color = [-0.25, -0.25, 0.75]
@@ -31,6 +41,20 @@ class ViewModel(object):
         )
         self.scr = Screen(disptype="psychopy", bgc=(125, 125, 125))
         self.cst_view = View(pygaze.expdisplay)
+        self.rendered_text = {}  # last text set on each display
+        self.cst_user_input = None  # connected by the first set_parameters
+        # retained rendering: static layer and the per-frame draw list
+        self.static_layer = None
+        self.frame_layers = None
+        # replaced by the StateMachine's timer in set_parameters
+        self.frame_timer = FrameTimer()
+        self.pause_secs = 0.0  # crash pause added to the last flip target
+        self.flip_scheduler = FlipScheduler()
+        self.flip_target = 0.0  # vblank the last flip was scheduled for
+        # OnsetSchedule of the current run, set by the StateMachine
+        self.schedule = None
+        # FixedStepPhysics, set by the StateMachine when PHYSICS_HZ > 0
+        self.physics = None
 
     def update_score(self):
         if abs(self.state_params.stim_pos) < self.cst_view.outer_stim.radius:
@@ -40,6 +64,18 @@ class ViewModel(object):
         self.task_params = task_params
         self.state_params = state_params
 
+        # the input devices are connected once and reused by later phases
+        if self.cst_user_input is None:
+            self.connect_input()
+
+        if self.task_params.RETAINED_RENDERING and self.frame_layers is None:
+            self.build_frame_layers()
+
+        num_frames = self.task_params.REFRESH_MEASURE_FRAMES
+        if num_frames > 0 and self.flip_scheduler.refresh_period is None:
+            self.flip_scheduler.measure_refresh(self.flip_now, num_frames)
+
+    def connect_input(self):
         self.cst_user_input = CST_User_Input()
 
         self.cst_user_input.connect_press_object(
@@ -51,18 +87,37 @@ class ViewModel(object):
             window=pygaze.expdisplay,
             reverse_coords=self.task_params.REVERSE_COORDS,
             swap_axes=self.task_params.SWAP_AXES,
+            stream_hz=self.task_params.ACCEL_STREAM_HZ,
         )
+        if self.task_params.INPUT_FILTER is not None:
+            self.cst_user_input.set_input_filter(
+                self.task_params.INPUT_FILTER,
+                self.task_params.INPUT_PREDICT_SECS,
+                **self.task_params.INPUT_FILTER_PARAMS,
+            )
+
+    def flip_now(self):
+        self.disp.show()
+        return self.clock.getTime()
+
+    def set_display_text(self, name, text):
+        """setText on a cst_view text display, only if 'text' changed."""
+        if self.rendered_text.get(name) != text:
+            getattr(self.cst_view, name).setText(text)
+            self.rendered_text[name] = text
 
     def update_text_boxes(self):
         """Updates values in the text displays"""
         self.update_score()
-        self.cst_view.score_display.setText(
-            f"Score:{int(self.state_params.current_score)}"
+        self.set_display_text(
+            "score_display", f"Score:{int(self.state_params.current_score)}"
         )
-        self.cst_view.lambda_display.setText(
-            f"Lambda: {int(self.state_params.lambda_val*1000)}"
+        self.set_display_text(
+            "lambda_display", f"Lambda: {int(self.state_params.lambda_val*1000)}"
+        )
+        self.set_display_text(
+            "time_display", f"Time: {self.state_params.flip_time:3.1f}"
         )
-        self.cst_view.time_display.setText(f"Time: {self.state_params.flip_time:3.1f}")
 
     def update_stim_properties(self):
 
@@ -99,13 +154,43 @@ class ViewModel(object):
         self.scr.screen.append(self.cst_view.right_bounds)
         self.scr.screen.append(self.cst_view.fix)
 
-    def draw_stim_screen(self):
-        """Draws the screen objects."""
+    def build_frame_layers(self):
+        """
+        Pre-render the background, bounds and fixation into one image
+        and set up the list drawn each frame: that image, the text boxes
+        and the stimuli, in the same order draw_stim_screen uses.
+        """
+        self.scr.clear()
+        self.draw_background()
+        self.static_layer = visual.BufferImageStim(
+            pygaze.expdisplay, stim=list(self.scr.screen)
+        )
+        self.frame_layers = [
+            self.static_layer,
+            self.cst_view.score_display,
+            self.cst_view.lambda_display,
+            self.cst_view.time_display,
+            self.cst_view.outer_stim,
+            self.cst_view.stim,
+        ]
+        self.scr.clear()
+
+    def draw_stim_screen(self, stim_pos=None):
+        """Draws the screen objects, with the stimulus at 'stim_pos'
+        (default: the current state_params.stim_pos)."""
+        if stim_pos is None:
+            stim_pos = self.state_params.stim_pos
         # update stimulus position
         self.cst_view.outer_stim.pos = self.cst_view.stim.pos = [
-            self.state_params.stim_pos,
+            stim_pos,
             0,
         ]
+        if self.frame_layers is not None:
+            self.update_text_boxes()
+            self.update_stim_properties()
+            # a copy, since callers may append labels to the screen
+            self.scr.screen = list(self.frame_layers)
+            return
         self.draw_background()
         self.update_text_boxes()
         self.draw_text_boxes()
@@ -130,7 +215,7 @@ class ViewModel(object):
         and set lambda to 50% of escape value."""
 
         # induce slow drift randomly to left or right.
-        d = np.random.randint(0, 2, 1)
+        d = self.rng.randint(0, 2, 1)
         if d:
             direction = -1
         else:
@@ -145,6 +230,8 @@ class ViewModel(object):
         self.scr.screen.append(self.cst_view.reset_label)
         self.cst_user_input.reset_xy_position()
         self.state_params.user_pos = 0.0
+        # the run clock is about to be reset
+        self.flip_scheduler.reset()
         event.Mouse(visible=False)
         self.disp.fill(screen=self.scr)
         self.disp.show()
@@ -154,7 +241,7 @@ class ViewModel(object):
         and set lambda to 50% of escape value."""
 
         # induce slow drift randomly to left or right.
-        d = np.random.randint(0, 2, 1)
+        d = self.rng.randint(0, 2, 1)
         if d:
             direction = -1
         else:
@@ -179,6 +266,8 @@ class ViewModel(object):
         self.cst_user_input.reset_xy_position()
 
     def wait_for_pulse(self, pulse_key="T"):
+        import serial
+
         ser = serial.Serial("/dev/ttyUSB0", 19200, timeout=30)
         ser.flushInput()
         x = ""
@@ -211,6 +300,7 @@ class ViewModel(object):
         Draw stimulus view with passed params.
         Flip screen at a specific time.
         """
+        self.pause_secs = 0.0
         if self.state_params.is_OOB is True:
             start_pause = exp_clock.getTime()
             self.state_params.did_crash = True
@@ -218,23 +308,45 @@ class ViewModel(object):
             self.reset_stim()
             self.state_params.is_OOB = False
             end_pause = exp_clock.getTime()
+            if self.physics is not None:
+                # step on from the reset stimulus
+                self.physics.reset(end_pause)
             elapsed_time = end_pause - start_pause
             # account for reset time in future onsets
-            self.task_params.ONSETS += elapsed_time
+            self.schedule.add_pause(start_pause, end_pause)
             # and for current trial.
             at_time += elapsed_time
-
-        self.scr.clear()
+            self.pause_secs = elapsed_time
+        self.frame_timer.mark(PAUSE)
+
+        self.flip_target = self.flip_scheduler.target(at_time)
+
+        stim_pos = None
+        if self.physics is not None:
+            # step the model while we wait, then draw its latest state
+            self.physics.run_until(
+                exp_clock,
+                self.flip_scheduler.issue_time(self.flip_target)
+                - self.physics.render_lead,
+            )
+            stim_pos = self.physics.render_pos(self.flip_target)
+        self.frame_timer.mark(PHYSICS)
+
+        if self.frame_layers is None:
+            self.scr.clear()
         # self.update_score()
         # self.update_text_boxes()
         response = event.getKeys()
         self.handle_key_events(response)
-        self.draw_stim_screen()
+        self.draw_stim_screen(stim_pos)
         self.disp.fill(screen=self.scr)
-        wait_time = at_time - exp_clock.getTime()
-        core.wait(wait_time)
+        self.frame_timer.mark(DRAW)
+        self.flip_scheduler.wait_for(exp_clock, self.flip_target)
+        self.frame_timer.mark(WAIT)
         self.disp.show()
+        self.frame_timer.mark(FLIP)
 
         flip_time = exp_clock.getTime()
+        self.flip_scheduler.flipped(flip_time)
 
         return flip_time
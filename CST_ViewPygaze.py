@@ -1,6 +1,72 @@
 from psychopy import visual
 
 
+class GlyphText(object):
+    """
+    Text drawn from pre-rendered glyphs: a fixed label followed by a
+    number, e.g. "Score:125".
+
+    One TextStim is made up front for every (slot, character) pair, so
+    setting new text only changes which stims get drawn and nothing is
+    re-rasterized. Has setText() and draw() like a TextStim; the text
+    must start with 'label' and continue with at most 'num_slots'
+    characters from 'chars'.
+    """
+
+    def __init__(
+        self,
+        win,
+        label,
+        num_slots=6,
+        chars="0123456789.-",
+        pos=(0, 0),
+        height=0.1,
+        color=(-1.0, -1.0, -1.0),
+        units="norm",
+    ):
+        self.label = label
+        # digits have the same advance in most fonts: ~0.6 of the height
+        char_width = 0.6 * height
+        if units == "norm":
+            char_width *= win.size[1] / win.size[0]
+
+        text_args = dict(
+            win=win, color=color, colorSpace="rgb", height=height, units=units
+        )
+        self.label_stim = visual.TextStim(
+            text=label, pos=pos, anchorHoriz="right", **text_args
+        )
+        self.glyphs = [
+            {
+                c: visual.TextStim(
+                    text=c,
+                    pos=(pos[0] + k * char_width, pos[1]),
+                    anchorHoriz="left",
+                    **text_args,
+                )
+                for c in chars
+            }
+            for k in range(num_slots)
+        ]
+        self.text = label
+        self.visible = []
+
+    def setText(self, text):
+        value = text[len(self.label) :]
+        if not text.startswith(self.label) or len(value) > len(self.glyphs):
+            raise ValueError(f"GlyphText cannot show {text!r}")
+        try:
+            self.visible = [self.glyphs[k][c] for k, c in enumerate(value)]
+        except KeyError:
+            raise ValueError(f"GlyphText cannot show {text!r}")
+        self.text = text
+
+    def draw(self):
+        self.label_stim.draw()
+        for glyph in self.visible:
+            glyph.draw()
+
+
 class View:
     """
     Class holding view objects.
@@ -102,11 +168,10 @@ class View:
         )
 
         # Top, Center
-        self.score_display = visual.TextStim(
-            win=win,
-            text="Score:",
+        self.score_display = GlyphText(
+            win,
+            "Score:",
             color=[-1.0, -1.0, -1.0],
-            colorSpace="rgb",
             pos=(0, 0.9),
             units="norm",
         )
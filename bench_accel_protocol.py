@@ -0,0 +1,120 @@
+"""
+Microbenchmark: ASCII vs binary accelerometer reads.
+
+Times get_tared_as_euler (getPos) and get_tared_as_euler_w_ts
+(poll_and_update) through AccelerometerBase (ASCII) and
+AccelerometerBinary. By default the sensor is replaced with an in-memory
+loopback port that answers each request instantly with a canned
+response, so the numbers are the host-side encode/parse cost only.
+Pass --port to time a real, connected sensor instead.
+
+    python bench_accel_protocol.py --calls 20000
+    python bench_accel_protocol.py --port /dev/ttyACM0 --calls 500
+"""
+
+import argparse
+import struct
+import time
+
+import numpy as np
+
+from CST_Accelerometer_01 import AccelerometerBase, AccelerometerBinary
+from CST_Utility_Functions import SerialConstants2
+
+
+class LoopbackSerial(object):
+    """Stand-in serial port that answers known requests with canned bytes."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.pending = b""
+
+    def write(self, request):
+        self.pending = self.responses.get(request, b"")
+
+    def flush(self):
+        pass
+
+    def readline(self):
+        reply, self.pending = self.pending, b""
+        return reply
+
+    def readinto(self, buf):
+        n = len(self.pending)
+        buf[:n] = self.pending
+        self.pending = b""
+        return n
+
+    def close(self):
+        pass
+
+
+def loopback_responses(consts):
+    euler = (0.0123, -0.4567, 0.8910)
+    ts = 123456789
+    euler_str = ",".join(f"{v:0.6f}" for v in euler)
+    responses = {
+        consts.get_tared_as_euler: str.encode(f"{euler_str}\r\n"),
+        consts.get_tared_as_euler_w_ts: str.encode(f"{ts},{euler_str}\r\n"),
+    }
+    for request in (consts.get_tared_as_euler, consts.get_tared_as_euler_w_ts):
+        packet, fmt = consts.as_binary(request)
+        if fmt.startswith(consts.binary_header_format):
+            responses[packet] = struct.pack(fmt, ts, *euler)
+        else:
+            responses[packet] = struct.pack(fmt, *euler)
+    return responses
+
+
+def time_calls(func, num_calls, repeats):
+    """Median microseconds per call over 'repeats' runs of 'num_calls'."""
+    per_call = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(num_calls):
+            func()
+        per_call.append((time.perf_counter() - t0) / num_calls * 1e6)
+    return float(np.median(per_call))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", default=None, help="Real sensor; default=loopback")
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    consts = SerialConstants2()
+    ascii_accel = AccelerometerBase()
+    binary_accel = AccelerometerBinary()
+    if args.port is None:
+        loopback = LoopbackSerial(loopback_responses(consts))
+        ascii_accel.ser = binary_accel.ser = loopback
+    else:
+        ascii_accel.connect_to_wired(mount_point=args.port)
+        binary_accel.connect_to_wired(mount_point=args.port)
+
+    print(f"{'command':<26}{'ascii_us':>10}{'binary_us':>11}{'speedup':>9}")
+    cases = [
+        ("get_tared_as_euler", ascii_accel.getPos, binary_accel.getPos),
+        (
+            "get_tared_as_euler_w_ts",
+            ascii_accel.poll_and_update,
+            binary_accel.poll_and_update,
+        ),
+    ]
+    for name, ascii_call, binary_call in cases:
+        ascii_us = time_calls(ascii_call, args.calls, args.repeats)
+        binary_us = time_calls(binary_call, args.calls, args.repeats)
+        print(
+            f"{name:<26}{ascii_us:>10.2f}{binary_us:>11.2f}"
+            f"{ascii_us / binary_us:>8.1f}x"
+        )
+
+    if args.port is not None:
+        ascii_accel.shutdown()
+        binary_accel.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Headless end-to-end benchmark of the StateMachine.run loop.
+
+Drives a real StateMachine / CST_Model with the stand-in view, input
+and MoBI backends from CST_Headless (no window, participant or
+hardware) at each requested loop rate. For every rate it reports the
+achieved rate, the flip error distribution, the per-phase timings from
+FrameTimer, CPU time per frame and net allocated blocks per frame. The
+results are saved as JSON so runs from different versions can be
+compared.
+
+    python bench_loop_jitter.py --rates 30 60 120 240 --duration 20
+    python bench_loop_jitter.py --mobi_async --out bench_async.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from CST_Calculations import compute_timeseries
+from CST_Data_Structures import TaskParameters
+from CST_Headless import HeadlessClock, HeadlessMoBI, HeadlessViewModel
+from CST_Schema import StateRecord
+from CST_StateMachine import StateMachine
+
+
+def git_version():
+    try:
+        out = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+        )
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+def run_once(loop_hz, duration, out_dir, args):
+    task_params = TaskParameters()
+    task_params.TASK_MODE = "CPT"
+    task_params.TASK_LOOP_RATE = 1 / loop_hz
+    task_params.MAX_SECONDS = duration
+    task_params.PHYSICS_HZ = args.physics_hz
+    task_params.ONSETS = compute_timeseries(
+        (duration + 30) / 60, task_params.TASK_LOOP_RATE
+    )
+    # BIDS-style stem, like get_session_params builds
+    task_params.OUTPUT_STEM = str(
+        Path(out_dir) / f"sub-bench_ses-1_task-CPT_run-{loop_hz:g}hz_events"
+    )
+
+    state_params = StateRecord()
+    state_params.lambda_val = state_params.lambda_intercept = 0.1
+    state_params.lambda_slope = 0
+    state_params.max_lambda = 0.5
+
+    mobi_dict = {
+        "dispatch_mode": "async" if args.mobi_async else "sync",
+        "sync_devices": ["eeg"],
+    }
+    view_model = HeadlessViewModel(
+        refresh_hz=args.refresh_hz, draw_secs=args.draw_ms / 1000
+    )
+    sm = StateMachine(
+        view_model=view_model, mobi_factory=HeadlessMoBI, clock=HeadlessClock()
+    )
+    sm.set_parameters(task_params, state_params, mobi_dict)
+
+    gc.collect()
+    gc_before = [s["collections"] for s in gc.get_stats()]
+    blocks_before = sys.getallocatedblocks()
+    cpu_before = time.process_time()
+    wall_before = time.perf_counter()
+    sm.run()
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    blocks = sys.getallocatedblocks() - blocks_before
+    gc_after = [s["collections"] for s in gc.get_stats()]
+
+    timer = sm.frame_timer
+    frames = timer.num_frames
+    flips = timer.flipped[:frames]
+    summary = timer.summary(task_params.TASK_LOOP_RATE / 2)
+    achieved_hz = (frames - 1) / (flips[-1] - flips[0]) if frames > 1 else 0.0
+    return {
+        "loop_hz": loop_hz,
+        "duration_secs": duration,
+        "frames": int(frames),
+        "achieved_hz": float(achieved_hz),
+        "wall_secs": wall,
+        "cpu_ms_per_frame": cpu / frames * 1000,
+        "cpu_load": cpu / wall,
+        "net_blocks_per_frame": blocks / frames,
+        "gc_collections": [a - b for a, b in zip(gc_after, gc_before)],
+        "flip_interval": timer.percentiles(np.diff(flips) * 1000),
+        "flip_error": summary["flip_error"],
+        "phases": summary["phases"],
+        "num_late_frames": summary["num_late_frames"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[30, 60, 120, 240])
+    parser.add_argument("--duration", type=float, default=10, help="secs per rate")
+    parser.add_argument("--refresh_hz", type=float, default=None)
+    parser.add_argument("--draw_ms", type=float, default=0.0)
+    parser.add_argument("--physics_hz", type=float, default=0)
+    parser.add_argument("--mobi_async", action="store_true")
+    parser.add_argument("--out", default="bench_loop_jitter.json")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for loop_hz in args.rates:
+            res = run_once(loop_hz, args.duration, out_dir, args)
+            results.append(res)
+            print(
+                f"{loop_hz:6g} Hz: achieved {res['achieved_hz']:8.2f} Hz, "
+                f"flip error p50/p99/max "
+                f"{res['flip_error']['p50_ms']:.3f}/"
+                f"{res['flip_error']['p99_ms']:.3f}/"
+                f"{res['flip_error']['max_ms']:.3f} ms, "
+                f"cpu {res['cpu_ms_per_frame']:.3f} ms/frame, "
+                f"{res['net_blocks_per_frame']:.2f} blocks/frame"
+            )
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "version": git_version(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
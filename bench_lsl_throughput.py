@@ -0,0 +1,161 @@
+"""
+Benchmark of the LSL streaming path, with the CST_LSLStandin recorder
+in place of pylsl.
+
+For each chunk size it runs:
+
+  push    : 'pushes' task-value samples through MoBI_Devices.send and
+            the LSLChunker as fast as possible, and reports the cost per
+            call on the task thread and the sustained samples/sec that
+            reached the outlet.
+  session : a headless StateMachine run (CST_Headless view, input and
+            MoBI), and reports the MOBI phase timing, the recorder stats
+            (calls, samples/sec, delay from flip to outlet) and whether
+            every frame reached the stream with its flip_time as the
+            timestamp.
+
+    python bench_lsl_throughput.py --chunk_samples 1 8 32 --duration 10
+    python bench_lsl_throughput.py --mobi_async --chunk_ms 50 --out lsl.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from CST_Calculations import compute_timeseries
+from CST_Data_Structures import TaskParameters
+from CST_Headless import HeadlessClock, HeadlessViewModel
+from CST_LSLStandin import LSLRecorder, StandinMoBI
+from CST_Schema import StateRecord
+from CST_StateMachine import StateMachine
+from bench_loop_jitter import git_version
+
+
+def mobi_dict_for(chunk_samples, args):
+    return {
+        "dispatch_mode": "async" if args.mobi_async else "sync",
+        "sync_devices": ["eeg"],
+        "lsl_chunk_samples": chunk_samples,
+        "lsl_chunk_ms": args.chunk_ms,
+    }
+
+
+def run_push(chunk_samples, args):
+    recorder = LSLRecorder(max_records=args.pushes)
+    mobi_dev = StandinMoBI(mobi_dict_for(chunk_samples, args), recorder)
+    vals = [0.0] * 10
+
+    started_at = time.perf_counter()
+    for k in range(args.pushes):
+        mobi_dev.send("lsl_chunker", "push", vals, mobi_dev.lsl_time(k / 1000))
+    queued_at = time.perf_counter()
+    mobi_dev.send("lsl_chunker", "flush")
+    mobi_dev.close_dispatch()
+    ended_at = time.perf_counter()
+
+    stream = recorder.report()["cpCST"]
+    return {
+        "us_per_push": (queued_at - started_at) / args.pushes * 1e6,
+        "samples_per_sec": args.pushes / (ended_at - started_at),
+        "outlet": stream,
+    }
+
+
+def run_session(chunk_samples, out_dir, args):
+    task_params = TaskParameters()
+    task_params.TASK_MODE = "CPT"
+    task_params.TASK_LOOP_RATE = 1 / args.loop_hz
+    task_params.MAX_SECONDS = args.duration
+    task_params.ONSETS = compute_timeseries(
+        (args.duration + 30) / 60, task_params.TASK_LOOP_RATE
+    )
+    task_params.OUTPUT_STEM = str(
+        Path(out_dir) / f"sub-bench_ses-1_task-CPT_run-{chunk_samples}_events"
+    )
+    state_params = StateRecord()
+    state_params.lambda_val = state_params.lambda_intercept = 0.1
+    state_params.lambda_slope = 0
+    state_params.max_lambda = 0.5
+
+    recorder = LSLRecorder()
+    sm = StateMachine(
+        view_model=HeadlessViewModel(),
+        mobi_factory=StandinMoBI.factory(recorder),
+        clock=HeadlessClock(),
+    )
+    sm.set_parameters(task_params, state_params, mobi_dict_for(chunk_samples, args))
+    sm.run()
+
+    timer = sm.frame_timer
+    summary = timer.summary(task_params.TASK_LOOP_RATE / 2)
+    timestamps, values = recorder.stream("cpCST")
+    # each sample carries the flip_time it was logged with
+    flip_index = sm.logged_values.index("flip_time")
+    logged_flips = np.array([v[flip_index] for v in values])
+    stamped_flips = np.array(timestamps) - sm.mobi_dev.lsl_offset
+    return {
+        "frames": int(timer.num_frames),
+        "mobi_phase": summary["phases"]["mobi"],
+        "streams": recorder.report(),
+        "all_frames_streamed": len(values) == timer.num_frames,
+        "max_timestamp_error_us": (
+            float(np.abs(stamped_flips - logged_flips).max() * 1e6)
+            if len(values) > 0
+            else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunk_samples", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--chunk_ms", type=float, default=0)
+    parser.add_argument("--pushes", type=int, default=100000)
+    parser.add_argument("--loop_hz", type=float, default=60)
+    parser.add_argument("--duration", type=float, default=10, help="session secs")
+    parser.add_argument("--mobi_async", action="store_true")
+    parser.add_argument("--out", default="bench_lsl_throughput.json")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for chunk_samples in args.chunk_samples:
+            push = run_push(chunk_samples, args)
+            session = run_session(chunk_samples, out_dir, args)
+            results.append(
+                {"chunk_samples": chunk_samples, "push": push, "session": session}
+            )
+            delay = session["streams"]["cpCST"].get("delay_ms", {})
+            print(
+                f"chunk {chunk_samples:4d}: {push['us_per_push']:.2f} us/push, "
+                f"{push['samples_per_sec']:.0f} samples/s; session mobi p99 "
+                f"{session['mobi_phase']['p99_ms']:.3f} ms, delay p99 "
+                f"{delay.get('p99', float('nan')):.2f} ms, "
+                f"all frames streamed: {session['all_frames_streamed']}"
+            )
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "version": git_version(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
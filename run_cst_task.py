@@ -1,21 +1,51 @@
-import numpy as np
-from psychopy import event
-from CST_StateMachine import StateMachine
-from CST_Utility_Functions import SerialConstants2, cst_parser, get_session_params
+import sys
+import time
 
-args = cst_parser()
-ser_consts = SerialConstants2()
+started_at = time.perf_counter()
 
-# Initialize task with appropriate info
-TPV = get_session_params(args.args(), task_init_path="1D_CPT_static_accel.par")
-# TPV["cal_task"].TASK_MODE = "CALIBRATE"
+from CST_StartupProfile import StartupProfile
 
-practice_task = StateMachine()
+# startup phases are always timed; --profile_startup reports them and exits
+profile = StartupProfile(started_at)
+
+with profile.phase("import numpy"):
+    import numpy as np
+with profile.phase("import CST_Utility_Functions"):
+    from CST_Utility_Functions import SerialConstants2, cst_parser, get_session_params
+
+with profile.phase("session parameters"):
+    args = cst_parser()
+    ser_consts = SerialConstants2()
+
+    # Initialize task with appropriate info
+    cl_args = args.args()
+    TPV = get_session_params(cl_args, task_init_path="1D_CPT_static_accel.par")
+    # TPV["cal_task"].TASK_MODE = "CALIBRATE"
+
+# imported by CST_StateMachine anyway; imported first to time them apart
+with profile.phase("import psychopy"):
+    from psychopy import core, event, visual
+with profile.phase("import pygaze"):
+    import pygaze.libscreen
+with profile.phase("import CST_StateMachine"):
+    from CST_Session import CST_Session
+    from CST_StateMachine import StateMachine
+
+# one window, input and MoBI device session for all three phases
+with profile.phase("window (CST_Session)"):
+    session = CST_Session()
+    practice_task = StateMachine(session=session)
 
 TPV["cpt_state"].max_lambda = 0.05
 TPV["cpt_state"].lambda_val = 0.01
 TPV["cpt_task"].TASK_MODE = "PRACTICE"
-practice_task.set_parameters(TPV["cpt_task"], TPV["cpt_state"], TPV["mobi_dict"])
+with profile.phase(f"input ({TPV['cpt_task'].XY_INPUT_MODE}) and MoBI devices"):
+    practice_task.set_parameters(TPV["cpt_task"], TPV["cpt_state"], TPV["mobi_dict"])
+
+if cl_args.profile_startup:
+    profile.report("startup_profile.json")
+    session.close()
+    sys.exit(0)
 
 inst = []
 inst.append(
@@ -67,7 +97,7 @@ for k in range(len(inst)):
     practice_task.show_instructions(message_str=inst[k])
 
 
-cst_task = StateMachine()
+cst_task = StateMachine(session=session)
 # set parameters
 TPV["cal_task"].TASK_MODE = "CALIBRATE"
 TPV["cpt_state"].lambda_val = 0.1
@@ -93,7 +123,7 @@ TPV["cpt_state"].max_lambda = cpt_max_lambda  # set CPT max as % of lambda_c
 TPV["cpt_state"].current_score = 0  # carry score over from calibration
 TPV["cpt_state"].lambda_val = cpt_max_lambda * 0.5  # set init as 1/2 of CPT max
 
-cpt_task = StateMachine()
+cpt_task = StateMachine(session=session)
 cpt_task.set_parameters(TPV["cpt_task"], TPV["cpt_state"], TPV["mobi_dict"])
 
 inst = []
@@ -108,7 +138,6 @@ for k in range(len(inst)):
 
 cpt_lambda_c_vals = cpt_task.run()
 
-# If we are using the accelerometer, close it down nicely
-if TPV["cpt_task"].XY_INPUT_MODE == "ACCEL":
-    cst_task.view_model.cst_user_input.shutdown()
+# close the MoBI devices, the accelerometer (nicely) and the window
+session.close()
 
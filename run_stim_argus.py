@@ -4,27 +4,61 @@
 Created on Tue Jan 11 16:25:50 2022
 
 @author: jcloud
+
+One launcher window for the whole visit. The GUI runs on the main
+thread; an asyncio event loop on a second thread runs each launch:
+the task itself (through the warm stim_worker), the video recorder and
+the eyetracker calls, each with a timeout. Task output is streamed into
+the log pane, which keeps the last LOG_LINES lines. Launch is disabled
+while a task runs, and the window stays up between tasks. Closing the
+window while a task runs waits for that task to finish; its remaining
+messages go to the console.
 """
 
-import argparse
-import subprocess
-import time
+import asyncio
 import os
 import signal
+import sys
+import threading
 import time
+from collections import deque
+
 import PySimpleGUI as sg
 from argus_eyetracking_server import connect, record_data, save_data, show_eye_camera
 from gui import argus_gui, check_eye_camera
 import pygame
-import threading
+from stim_worker import AsyncStimWorker
 
-first_run = True
 tasks = ['SESSION 1', 'passivepresent', 'passivesherlock', 'segpresent', 'segsherlock', 'cst', 'checkerboard',
          'recallsherlock', '**switch to windows**', 'SESSION 2 V2', 'ravlt1', 'recallpresent', 'recallsherlock',
          'flanker', 'checkerboard', 'ravlt2', 'mst1', 'mst2', 'mst3', 'breathhold', 'nasa', 'SESSION 2 V1',
          'recallpresent', 'recallsherlock', 'passivepresent', 'passivesherlock', 'segpresent', 'segsherlock', 'mst1',
          'mst2', 'mst3', 'nasa', 'TESTER', 'tracksanity', 'foraging']
 
+programs = {
+    'recallpresent': 'freerecall_present.py',
+    'recallsherlock': 'freerecall_sherlock.py',
+    'ravlt1': 'ravlt_pt1.py',
+    'ravlt2': 'ravlt_pt2.py',
+    'nasa': 'nasa_lean.py',
+    'passivesherlock': 'sherlock.py',
+    'segsherlock': 'sherlock_segmentation.py',
+    'passivepresent': 'thepresent.py',
+    'segpresent': 'thepresent_segmentation.py',
+    'flanker': 'flanker.py',
+    'checkerboard': 'checkerboard.py',
+    'rey0': 'ipad_rey0.py',
+    'rey1': 'ipad_rey1.py',
+    'trails': 'ipad_trails.py',
+    'spirals': 'ipad_spirals.py',
+    'writesamples': 'ipad_writesamples.py',
+    'alphawrite': 'ipad_alphawrite.py',
+    'tracksanity': 'tracking_validation.py',
+    'breathhold': 'breathhold_lsl.py',
+    'foraging': 'foraging.py',
+    'cst': 'run_cst_task.py',
+}
+
 os.system('sudo apt-get install python-parallel')
 os.system('sudo rmmod lp')
 os.system('sudo modprobe ppdev')
@@ -40,191 +74,278 @@ if len(day) == 1:
     day = '0' + day
 date = year + month + day
 
+STIM_DIR = '/home/nkirs/Desktop/MOBI/Stimuli/'
+OUTPUT_DIR = '/home/nkirs/Desktop/MOBI/Output/'
+LOG_LINES = 2000  # lines kept in the log pane
+DEVICE_TIMEOUT = 30  # secs allowed for each eyetracker call
+VIDEO_STOP_TIMEOUT = 10  # secs the video recorder gets to save after SIGINT
+SAVE_RETRIES = 5
 
-def MainMenu(ID='', Visit='', Run='', EEG=False, Eyetracking=False, Video=False):
-    global first_run
-    pygame.init()
-    layout = [
-        [sg.Text('ID', font=('Verdana, 12')), sg.Input(ID, key='id', font=('Verdana, 12'))],
-        [sg.Text('Visit', font=('Verdana, 12')), sg.Input(Visit, key='visit', font=('Verdana, 12'))],
-        [sg.Text('Run', font=('Verdana, 12')), sg.Input(Run, key='run', font=('Verdana, 12'))],
-        [sg.Checkbox('EEG?', key='eeg', default=EEG, font=('Verdana, 12')),
-         sg.Checkbox('Eyetracking?', key='el', default=Eyetracking, font=('Verdana, 12')),
-         sg.Checkbox('Video?', key='video', default=Video, font=('Verdana, 12'))],
-        [sg.Combo(tasks, key='task', font=('Verdana, 12'))],
-        [sg.Button('Launch', font=('Verdana, 12')), sg.Button('Close', font=('Verdana, 12'))]
-    ]
-
-    window = sg.Window('RS2 Stimuli Launcher - Main Menu', layout)
-
-    while True:
-        event, values = window.read()
-        if event == sg.WIN_CLOSED or event == 'Close':
-            window.close()
-            break
-        if event == 'Launch':
-            window.close()
-            if len(values['id']) > 0 and len(values['visit']) > 0 and len(values['run']) > 0 and len(
-                    values['task']) > 0:
-                try:
-                    x = int(values['run'])
-                except:
-                    sg.Popup('Please select an integer value for "RUN"')
-                    continue
 
-                task_output_dir = '/home/nkirs/Desktop/MOBI/Output/sub-{}/ses-{}/raw/'.format(values['id'],
-                                                                                              values['visit'])
-                raw_output_dir = '/home/nkirs/Desktop/MOBI/Output/sub-{}/ses-{}/raw/'.format(values['id'],
-                                                                                             values['visit'])
-
-                if not os.path.exists(task_output_dir):
-                    os.makedirs(task_output_dir)
-                if not os.path.exists(raw_output_dir):
-                    os.makedirs(raw_output_dir)
-
-                task_filename = os.path.join(task_output_dir,
-                                             'sub-{}_ses-{}_task-{}_run-{}_events.csv'.format(values['id'],
-                                                                                              values['visit'],
-                                                                                              values['task'],
-                                                                                              values['run']))
-                raw_filename = os.path.join(raw_output_dir, 'sub-{}_ses-{}_task-{}_run-{}_{}.{}')
-                if values['video']:
-                    f = raw_filename.format(values['id'], values['visit'], values['task'], values['run'], 'video',
-                                            'avi')
-                    video = subprocess.Popen(
-                        ['python', '/home/nkirs/Desktop/MOBI/Stimuli/webcam_video.py', '--filename', f])
-                    sg.Popup('Wait until video window appears, then press OK')
-
-                if values['el']:
-                    if first_run:
-                        sg.Popup('On the Eyetracking laptop, run server.py from the MOBI folder')
-                        first_run = True
-                    f = raw_filename.format(values['id'], values['visit'], values['task'], values['run'], 'eyetracking', 'edf')
-                    connect(values['id'], values['visit'], values['task'], values['run'])
-                    sg.Popup('Complete Argus calibration')
-                    record_data()
-                    sg.Popup('Record start time in MOBI checklist')
-                
-                else:
-                   sg.Popup('Record start time in MOBI checklist') 
-
-                if values['eeg'] and 'mst' not in values['task'] and 'cst' not in values['task']:
-                    eeg = '--withEEG True&'
-                elif 'mst1' in values['task']:
-                    eeg = 'Phase1&'
-                elif 'mst2' in values['task']:
-                    eeg = 'Phase2&'
-                elif 'mst3' in values['task']:
-                    eeg = 'Phase3&'
-                elif 'cst' in values['task']:
-                    eeg = ''
-                    if values['eeg']:
-                        eeg += '--eeg '
-                    eeg += '&'
-                else:
-                    eeg = '&'
-
-                if 'mst' in values['task']:
-                    task_process = 'python /home/nkirs/Desktop/MOBI/Stimuli/{} {}'
-                    task_filename = task_filename.replace('.csv', '.txt')
-                    task_process_practice = task_process.format('MST_practice.py', eeg)
-                    task_process = 'python /home/nkirs/Desktop/MOBI/Stimuli/{} {} {}'
-                    task_process = task_process.format('MST.py', task_filename, eeg)
-                    print('run practice')
-                    activity = subprocess.run(task_process_practice, shell=True, stdout=subprocess.PIPE)
-                    print('run task')
-                    activity2 = subprocess.run(task_process, shell=True, stdout=subprocess.PIPE)
-
-                else:
-                    if 'cst' in values['task']:
-                        task_process = 'python /home/nkirs/Desktop/MOBI/Stimuli/{} --subid {} --visit {} --run {} {}'
-                    else:
-                        task_process = 'python /home/nkirs/Desktop/MOBI/Stimuli/{} --filename {} {}'
-                    if values['task'] == 'recallpresent':
-                        program = 'freerecall_present.py'
-                    if values['task'] == 'recallsherlock':
-                        program = 'freerecall_sherlock.py'
-                    if values['task'] == 'ravlt1':
-                        program = 'ravlt_pt1.py'
-                    if values['task'] == 'ravlt2':
-                        program = 'ravlt_pt2.py'
-                    if values['task'] == 'nasa':
-                        program = 'nasa_lean.py'
-                    if values['task'] == 'passivesherlock':
-                        program = 'sherlock.py'
-                    if values['task'] == 'segsherlock':
-                        program = 'sherlock_segmentation.py'
-                    if values['task'] == 'passivepresent':
-                        program = 'thepresent.py'
-                    if values['task'] == 'segpresent':
-                        program = 'thepresent_segmentation.py'
-                    if values['task'] == 'flanker':
-                        program = 'flanker.py'
-                    if values['task'] == 'checkerboard':
-                        program = 'checkerboard.py'
-                    if values['task'] == 'rey0':
-                        program = 'ipad_rey0.py'
-                    if values['task'] == 'rey1':
-                        program = 'ipad_rey1.py'
-                    if values['task'] == 'trails':
-                        program = 'ipad_trails.py'
-                    if values['task'] == 'spirals':
-                        program = 'ipad_spirals.py'
-                    if values['task'] == 'writesamples':
-                        program = 'ipad_writesamples.py'
-                    if values['task'] == 'alphawrite':
-                        program = 'ipad_alphawrite.py'
-                    if values['task'] == 'tracksanity':
-                        program = 'tracking_validation.py'
-                    if values['task'] == 'breathhold':
-                        program = 'breathhold_lsl.py'
-                    if values['task'] == 'foraging':
-                        program = 'foraging.py'
-                    if values['task'] == 'cst':
-                        program = 'run_cst_task.py'
-                    if 'cst' in values['task']:
-                        task_process = task_process.format(program, values['id'], values['visit'], values['run'], eeg)
-                        print(task_process)
-                    else:
-                        task_process = task_process.format(program, task_filename, eeg)
-                    activity = subprocess.run(task_process, shell=True, stdout=subprocess.PIPE)
-                    if values['video']:
-                        video.send_signal(signal.SIGINT)
-                        video.wait()
-                        
-                sg.Popup('Record stop time in MOBI checklist')
-                time.sleep(1)
-                if values['el']:
-                    save_data_async()
-                time.sleep(5)
-                MainMenu(values['id'], values['visit'], values['run'], values['eeg'], values['el'], values['video'])
-
-            else:
-                window.close()
-                MainMenu()
-                sg.Popup('Please enter all values')
-                continue
-
-
-def save_data_async():
-    def save_data_with_retry():
-        max_retries = 5
-        retries = 0
-        while retries < max_retries:
+def task_runs(values, task_filename):
+    """(program, args) for each script the selected task runs, in order."""
+    task = values['task']
+    if values['eeg'] and 'mst' not in task and 'cst' not in task:
+        eeg_args = ['--withEEG', 'True']
+    elif 'mst1' in task:
+        eeg_args = ['Phase1']
+    elif 'mst2' in task:
+        eeg_args = ['Phase2']
+    elif 'mst3' in task:
+        eeg_args = ['Phase3']
+    elif 'cst' in task and values['eeg']:
+        eeg_args = ['--eeg']
+    else:
+        eeg_args = []
+
+    if 'mst' in task:
+        task_filename = task_filename.replace('.csv', '.txt')
+        return [('MST_practice.py', eeg_args), ('MST.py', [task_filename] + eeg_args)]
+    if task not in programs:
+        return []
+    if 'cst' in task:
+        args = ['--subid', values['id'], '--visit', values['visit'], '--run', values['run']]
+    else:
+        args = ['--filename', task_filename]
+    return [(programs[task], args + eeg_args)]
+
+
+class Launcher(object):
+    """
+    The launcher window and the asyncio loop that runs launches.
+
+    The loop thread talks to the GUI only through
+    window.write_event_value: '-LINE-' lines for the log pane, '-POPUP-'
+    for a message the experimenter must confirm (the launch waits for
+    it) and '-DONE-' when a launch has finished.
+    """
+
+    def __init__(self):
+        layout = [
+            [sg.Text('ID', font=('Verdana, 12')), sg.Input('', key='id', font=('Verdana, 12'))],
+            [sg.Text('Visit', font=('Verdana, 12')), sg.Input('', key='visit', font=('Verdana, 12'))],
+            [sg.Text('Run', font=('Verdana, 12')), sg.Input('', key='run', font=('Verdana, 12'))],
+            [sg.Checkbox('EEG?', key='eeg', default=False, font=('Verdana, 12')),
+             sg.Checkbox('Eyetracking?', key='el', default=False, font=('Verdana, 12')),
+             sg.Checkbox('Video?', key='video', default=False, font=('Verdana, 12'))],
+            [sg.Combo(tasks, key='task', font=('Verdana, 12'))],
+            [sg.Button('Launch', font=('Verdana, 12')), sg.Button('Close', font=('Verdana, 12'))],
+            [sg.Multiline('', key='-LOG-', size=(100, 20), autoscroll=True, disabled=True,
+                          font=('Courier, 10'))],
+        ]
+        self.window = sg.Window('RS2 Stimuli Launcher - Main Menu', layout, finalize=True)
+        self.log_lines = deque(maxlen=LOG_LINES)
+        self.num_shown = 0  # lines in the log pane
+        self.first_run = True
+        self.busy = False
+        self.launching = None  # future of the launch in progress
+        self.confirmations = set()  # popups the launch is waiting on
+        self.window_closed = False
+        self.background = set()  # eyetracker saves still running
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        # pre-imported python (psychopy, pygaze, CST modules) that each task forks from
+        self.stim_worker = AsyncStimWorker(on_output=self.log)
+        self.submit(self.stim_worker.start())  # preloads while the menu is up
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def log(self, line):
+        """Add a line to the log pane; safe from any thread."""
+        if self.window_closed:
+            print(line)
+            return
+        self.window.write_event_value('-LINE-', line)
+
+    def show_log_line(self, line):
+        self.log_lines.append(line)
+        if self.num_shown >= 2 * LOG_LINES:
+            # keep the pane (and its memory) bounded over a long visit
+            self.window['-LOG-'].update('\n'.join(self.log_lines) + '\n')
+            self.num_shown = len(self.log_lines)
+        else:
+            self.window['-LOG-'].print(line)
+            self.num_shown += 1
+
+    async def popup(self, message):
+        """Show 'message' in the GUI and wait until it is confirmed."""
+        if self.window_closed:
+            print(message)
+            return
+        confirmed = self.loop.create_future()
+        self.confirmations.add(confirmed)
+        self.window.write_event_value('-POPUP-', (message, confirmed))
+        await confirmed
+        self.confirmations.discard(confirmed)
+
+    async def call_device(self, name, func, *args):
+        """Run a blocking eyetracker call in a thread, with a timeout."""
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(func, *args), DEVICE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.log(f'{name} timed out after {DEVICE_TIMEOUT} s')
+        except Exception as e:
+            self.log(f'{name} failed: {e}')
+
+    async def start_video(self, filename):
+        video = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(STIM_DIR, 'webcam_video.py'), '--filename', filename,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        self.background.add(asyncio.ensure_future(self.watch_video(video)))
+        return video
+
+    async def watch_video(self, video):
+        """Stream the recorder's output; warn if it stops on its own."""
+        async for line in video.stdout:
+            self.log('[video] ' + line.decode(errors='replace').rstrip('\n'))
+        code = await video.wait()
+        if code != -signal.SIGINT and code != 0:
+            self.log(f'[video] recorder exited with code {code}')
+
+    async def stop_video(self, video):
+        if video.returncode is not None:
+            return
+        video.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(video.wait(), VIDEO_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.log(f'[video] no exit {VIDEO_STOP_TIMEOUT} s after SIGINT; killing it')
+            video.kill()
+            await video.wait()
+
+    async def save_eyetracking(self):
+        for attempt in range(SAVE_RETRIES):
             try:
-                save_data()
-                print("Data saved successfully")
-                break
+                await asyncio.wait_for(asyncio.to_thread(save_data), DEVICE_TIMEOUT)
+                self.log('Data saved successfully')
+                return
             except Exception as e:
-                print(f"Error while saving data: {e}")
-                retries += 1
-                time.sleep(1)  # Wait for 1 second before retrying
+                self.log(f'Error while saving data: {e!r}')
+                await asyncio.sleep(1)  # Wait for 1 second before retrying
+        self.log('Failed to save data after multiple attempts')
+
+    async def launch(self, values):
+        task_output_dir = os.path.join(OUTPUT_DIR, 'sub-{}/ses-{}/raw/'.format(values['id'], values['visit']))
+        os.makedirs(task_output_dir, exist_ok=True)
+        task_filename = os.path.join(task_output_dir,
+                                     'sub-{}_ses-{}_task-{}_run-{}_events.csv'.format(values['id'],
+                                                                                      values['visit'],
+                                                                                      values['task'],
+                                                                                      values['run']))
+        raw_filename = os.path.join(task_output_dir, 'sub-{}_ses-{}_task-{}_run-{}_{}.{}')
+        runs = task_runs(values, task_filename)
+        if len(runs) == 0:
+            self.log(f"No program for task {values['task']}")
+            return
+
+        video = None
+        if values['video']:
+            f = raw_filename.format(values['id'], values['visit'], values['task'], values['run'], 'video', 'avi')
+            video = await self.start_video(f)
+            await self.popup('Wait until video window appears, then press OK')
+
+        if values['el']:
+            if self.first_run:
+                await self.popup('On the Eyetracking laptop, run server.py from the MOBI folder')
+                self.first_run = False
+            await self.call_device('connect', connect, values['id'], values['visit'], values['task'], values['run'])
+            await self.popup('Complete Argus calibration')
+            await self.call_device('record_data', record_data)
+        await self.popup('Record start time in MOBI checklist')
 
-        if retries == max_retries:
-            print("Failed to save data after multiple attempts")
-    t = threading.Thread(target=save_data_with_retry)
-    t.start()
+        try:
+            for program, args in runs:
+                if self.window_closed:
+                    self.log(f'launcher closed; not starting {program}')
+                    break
+                self.log(f"run {program} {' '.join(args)}")
+                code = await self.stim_worker.run(os.path.join(STIM_DIR, program), args)
+                self.log(f'{program} exited with code {code}')
+        finally:
+            if video is not None:
+                await self.stop_video(video)
 
+        await self.popup('Record stop time in MOBI checklist')
+        if values['el']:
+            await asyncio.sleep(1)
+            save = asyncio.ensure_future(self.save_eyetracking())
+            self.background.add(save)
+        self.background = {t for t in self.background if not t.done()}
+
+    def launch_done(self, future):
+        if self.window_closed:
+            if future.exception() is not None:
+                print(f'launch failed: {future.exception()!r}')
+            return
+        self.window.write_event_value('-DONE-', future.exception())
+
+    def check_values(self, values):
+        if not (len(values['id']) > 0 and len(values['visit']) > 0 and len(values['run']) > 0
+                and len(values['task']) > 0):
+            sg.Popup('Please enter all values')
+            return False
+        try:
+            int(values['run'])
+        except ValueError:
+            sg.Popup('Please select an integer value for "RUN"')
+            return False
+        return True
+
+    def set_busy(self, busy):
+        self.busy = busy
+        self.window['Launch'].update(disabled=busy)
+
+    def run(self):
+        while True:
+            event, values = self.window.read()
+            if event == '-LINE-':
+                self.show_log_line(values['-LINE-'])
+            elif event == '-POPUP-':
+                message, confirmed = values['-POPUP-']
+                sg.Popup(message, keep_on_top=True)
+                self.loop.call_soon_threadsafe(confirmed.set_result, None)
+            elif event == '-DONE-':
+                if values['-DONE-'] is not None:
+                    self.show_log_line(f"launch failed: {values['-DONE-']!r}")
+                self.set_busy(False)
+            elif event == 'Launch' and not self.busy:
+                if self.check_values(values):
+                    self.set_busy(True)
+                    self.launching = self.submit(self.launch(values))
+                    self.launching.add_done_callback(self.launch_done)
+            elif event == sg.WIN_CLOSED or event == 'Close':
+                if self.busy and event == 'Close':
+                    sg.Popup('A task is still running')
+                    continue
+                if self.busy:
+                    # the window is gone; shutdown() waits for the task
+                    self.window_closed = True
+                    print('Launcher window closed; waiting for the running task to finish')
+                break
+        self.close()
+
+    async def shutdown(self):
+        if self.launching is not None and not self.launching.done():
+            # no window left to confirm popups in
+            for confirmed in self.confirmations:
+                if not confirmed.done():
+                    confirmed.set_result(None)
+            await asyncio.wait([asyncio.wrap_future(self.launching)])
+        pending = [t for t in self.background if not t.done()]
+        if len(pending) > 0:
+            # let eyetracker saves finish
+            await asyncio.wait(pending, timeout=DEVICE_TIMEOUT * SAVE_RETRIES)
+        await self.stim_worker.close()
+
+    def close(self):
+        self.submit(self.shutdown()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.window.close()
 
 if __name__ == "__main__":
-    MainMenu()
+    pygame.init()
+    Launcher().run()
@@ -0,0 +1,387 @@
+"""
+Warm worker for the stimulus launcher.
+
+Runs as a long-lived process that imports numpy, pandas, psychopy,
+pygaze and the CST modules once. For each task the launcher sends, it
+forks a child, which starts with all of that already imported, and
+runs the task script in it as __main__ with the given arguments. The
+child's stdout/stderr and its exit code are streamed back. Each task
+still gets a fresh process (and its own window), but skips the cold
+interpreter start and the import chain.
+
+The protocol is one JSON object per line, on the worker's stdin and
+stdout:
+
+    launcher -> worker   {"cmd": "run", "script": ..., "args": [...], "cwd": ...}
+                         {"cmd": "quit"}
+    worker -> launcher   {"event": "ready", "preload_secs": ..., "failed": [...]}
+                         {"event": "started", "pid": ..., "fork_secs": ...}
+                         {"event": "output", "line": ...}
+                         {"event": "exit", "code": ..., "secs": ...}
+
+StimWorkerClient starts the worker and runs tasks through it, and
+AsyncStimWorker does the same from an asyncio event loop. Both fall
+back to a plain subprocess if the worker can't be used (e.g. no fork()
+on Windows).
+
+    python stim_worker.py --preload numpy psychopy.visual CST_StateMachine
+"""
+
+import argparse
+import asyncio
+import atexit
+import importlib
+import json
+import os
+import runpy
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+PRELOAD_MODULES = [
+    "numpy",
+    "pandas",
+    "psychopy.core",
+    "psychopy.event",
+    "psychopy.visual",
+    "pygaze.libscreen",
+    "CST_Session",
+    "CST_StateMachine",
+    "CST_Utility_Functions",
+]
+WORKER_PATH = os.path.abspath(__file__)
+# longest line the asyncio client reads from a pipe (asyncio's default
+# is 64 KiB); longer lines are dropped with a message
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+def send_event(out, **event):
+    out.write(json.dumps(event) + "\n")
+    out.flush()
+
+
+def preload(modules):
+    """Import 'modules'; returns those that failed to import."""
+    failed = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as err:
+            failed.append(f"{name}: {err}")
+    return failed
+
+
+def run_child(script, args, cwd, out_fd):
+    """
+    In the forked child: run 'script' as __main__; never returns.
+    Ends like a normal interpreter exit (non-daemon threads joined,
+    atexit handlers run, output flushed) before os._exit, so tasks that
+    save or close things at exit still do.
+    """
+    os.dup2(out_fd, 1)
+    os.dup2(out_fd, 2)
+    os.close(out_fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)  # the protocol stays with the worker
+    os.close(devnull)
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+    code = 0
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        sys.argv = [script] + list(args)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as err:
+        if err.code is None:
+            code = 0
+        elif isinstance(err.code, int):
+            code = err.code
+        else:
+            print(err.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    try:
+        threading._shutdown()
+        atexit._run_exitfuncs()
+    except BaseException:
+        traceback.print_exc()
+        code = code or 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def run_task(request, out):
+    started_at = time.perf_counter()
+    read_fd, write_fd = os.pipe()
+    out.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        run_child(
+            request["script"], request.get("args", []), request.get("cwd"), write_fd
+        )
+    os.close(write_fd)
+    send_event(
+        out, event="started", pid=pid, fork_secs=time.perf_counter() - started_at
+    )
+    with os.fdopen(read_fd, "r", errors="replace") as child_out:
+        for line in child_out:
+            send_event(out, event="output", line=line.rstrip("\n"))
+    _, status = os.waitpid(pid, 0)
+    send_event(
+        out,
+        event="exit",
+        code=os.waitstatus_to_exitcode(status),
+        secs=time.perf_counter() - started_at,
+    )
+
+
+def serve(modules):
+    # keep the protocol channel away from anything the preloads print
+    out = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+    started_at = time.perf_counter()
+    failed = preload(modules)
+    send_event(
+        out,
+        event="ready",
+        preload_secs=time.perf_counter() - started_at,
+        failed=failed,
+    )
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request["cmd"] == "quit":
+            break
+        if request["cmd"] == "run":
+            run_task(request, out)
+
+
+class StimWorkerClient(object):
+    """
+    Launcher side of the warm worker.
+
+    start() launches the worker, which preloads in the background while
+    the launcher carries on; run() waits for it to be ready the first
+    time. If the worker dies, the next run() starts a new one. Where
+    fork() is missing or the worker can't start, run() falls back to a
+    cold 'python script args' subprocess.
+
+    Inputs:
+        preload   : modules the worker imports; default PRELOAD_MODULES
+        on_output : called with each line the task prints, and with
+                    the client's own status messages
+        python    : interpreter for the worker and the fallback
+    """
+
+    def __init__(self, preload=None, on_output=print, python=sys.executable):
+        self.preload = PRELOAD_MODULES if preload is None else preload
+        self.on_output = on_output
+        self.python = python
+        self.proc = None
+        self.ready = None  # the worker's "ready" event
+        self.last_run = None  # started/exit events of the last run
+
+    def worker_command(self):
+        return [self.python, WORKER_PATH, "--preload", *self.preload]
+
+    def got_ready(self, event):
+        self.ready = event
+        for failure in event["failed"]:
+            self.on_output(f"stim worker could not preload {failure}")
+
+    @staticmethod
+    def request_line(script, args, cwd):
+        request = {"cmd": "run", "script": script, "args": list(args), "cwd": cwd}
+        return json.dumps(request) + "\n"
+
+    def handle_event(self, event, requested_at):
+        """Handle one event of a run; returns True once it has exited."""
+        if event["event"] == "output":
+            self.on_output(event["line"])
+        elif event["event"] == "started":
+            event["launch_secs"] = time.perf_counter() - requested_at
+            self.last_run["started"] = event
+        elif event["event"] == "exit":
+            self.last_run["exit"] = event
+            return True
+        return False
+
+    def worker_failed(self, script, err):
+        """After losing the worker: True if the task should run cold."""
+        self.proc = None
+        if "started" in self.last_run:
+            # the task itself was running; don't run it twice
+            self.on_output(f"stim worker exited while running {script}")
+            return False
+        self.on_output(f"stim worker unavailable ({err}); starting {script} cold")
+        return True
+
+    def start(self):
+        if not hasattr(os, "fork"):
+            return
+        self.proc = subprocess.Popen(
+            self.worker_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            cwd=os.path.dirname(WORKER_PATH),
+        )
+        self.ready = None
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def read_event(self):
+        line = self.proc.stdout.readline()
+        if line == "":
+            raise EOFError("stim worker exited")
+        return json.loads(line)
+
+    def wait_ready(self):
+        if self.ready is None:
+            self.got_ready(self.read_event())
+        return self.ready
+
+    def run(self, script, args=(), cwd=None):
+        """
+        Run 'script' with 'args' in 'cwd' (default: the current
+        directory); returns its exit code, or None if the worker died
+        while the task was running.
+        """
+        if cwd is None:
+            cwd = os.getcwd()
+        if not self.is_alive():
+            self.start()
+        if self.proc is None:
+            return self.run_cold(script, args, cwd)
+        self.last_run = {}
+        try:
+            self.wait_ready()
+            self.proc.stdin.write(self.request_line(script, args, cwd))
+            self.proc.stdin.flush()
+            requested_at = time.perf_counter()
+            while not self.handle_event(self.read_event(), requested_at):
+                pass
+            return self.last_run["exit"]["code"]
+        except (EOFError, OSError) as err:
+            if self.worker_failed(script, err):
+                return self.run_cold(script, args, cwd)
+            return None
+
+    def run_cold(self, script, args, cwd):
+        return subprocess.run([self.python, script, *args], cwd=cwd).returncode
+
+    def close(self):
+        if self.is_alive():
+            self.proc.stdin.write(json.dumps({"cmd": "quit"}) + "\n")
+            self.proc.stdin.flush()
+            self.proc.wait()
+        self.proc = None
+
+
+class AsyncStimWorker(StimWorkerClient):
+    """
+    StimWorkerClient for an asyncio event loop: the worker and the cold
+    fallback are asyncio subprocesses, and start(), run() and close()
+    are coroutines, so the loop carries on while a task runs.
+    """
+
+    async def start(self):
+        if not hasattr(os, "fork"):
+            return
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.worker_command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(WORKER_PATH),
+            limit=STREAM_LIMIT,
+        )
+        self.ready = None
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def read_event(self):
+        while True:
+            try:
+                line = await self.proc.stdout.readline()
+                if line == b"":
+                    raise EOFError("stim worker exited")
+                return json.loads(line)
+            except ValueError:
+                # over STREAM_LIMIT (readline drops it), or the tail of one
+                self.on_output("stim worker: dropped an over-long output line")
+
+    async def wait_ready(self):
+        if self.ready is None:
+            self.got_ready(await self.read_event())
+        return self.ready
+
+    async def run(self, script, args=(), cwd=None):
+        if cwd is None:
+            cwd = os.getcwd()
+        if not self.is_alive():
+            await self.start()
+        if self.proc is None:
+            return await self.run_cold(script, args, cwd)
+        self.last_run = {}
+        try:
+            await self.wait_ready()
+            self.proc.stdin.write(self.request_line(script, args, cwd).encode())
+            await self.proc.stdin.drain()
+            requested_at = time.perf_counter()
+            while not self.handle_event(await self.read_event(), requested_at):
+                pass
+            return self.last_run["exit"]["code"]
+        except (EOFError, OSError) as err:
+            if self.worker_failed(script, err):
+                return await self.run_cold(script, args, cwd)
+            return None
+
+    async def run_cold(self, script, args, cwd):
+        proc = await asyncio.create_subprocess_exec(
+            self.python,
+            script,
+            *args,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=STREAM_LIMIT,
+        )
+        while True:
+            try:
+                line = await proc.stdout.readline()
+            except ValueError:
+                self.on_output("stim task: dropped an over-long output line")
+                continue
+            if line == b"":
+                break
+            self.on_output(line.decode(errors="replace").rstrip("\n"))
+        return await proc.wait()
+
+    async def close(self):
+        if self.is_alive():
+            self.proc.stdin.write(json.dumps({"cmd": "quit"}).encode() + b"\n")
+            await self.proc.stdin.drain()
+            await self.proc.wait()
+        self.proc = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--preload", nargs="*", default=PRELOAD_MODULES)
+    args = parser.parse_args()
+    serve(args.preload)
+
+
+if __name__ == "__main__":
+    main()